@@ -1 +1,6 @@
-from .hll import HyperLogLog
+from .hll import HyperLogLog, hash_values
+from .group import HyperLogLogGroup
+from .query import QueryEngine
+from .store import SketchStore
+from .window import WindowedHyperLogLog
+from .parallel import build_parallel
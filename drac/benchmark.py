@@ -0,0 +1,231 @@
+"""
+This module benchmarks the core HyperLogLog operations across precisions, minhash counter lengths and cardinalities
+
+Run it with python -m drac.benchmark; results are written as JSON and can be compared against a saved
+baseline, exiting with status 1 when an operation got slower or uses more memory than the threshold allows.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from .hll import HyperLogLog
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+PROFILES = {
+    'quick': {'precisions': [4, 10, 14], 'minhash_lens': [2**8, 2**16], 'cardinalities': [10, 10**4, 10**6]},
+    'full': {'precisions': list(range(4, 17)), 'minhash_lens': [2**8, 2**12, 2**16],
+             'cardinalities': [10**i for i in range(1, 9)]},
+}
+
+OPERATIONS = ['construct', 'add', 'add_many', 'update', 'card', 'serialize', 'deserialize',
+              'to_bytes', 'from_bytes', 'corrected_jaccard']
+
+def error_rate(p):
+    '''
+    Returns the error_rate for which HyperLogLog picks precision p
+    '''
+    return 1.04 / 2 ** ((p - 0.5) / 2)
+
+def splitmix64(x):
+    '''
+    Returns well mixed unsigned 64 bit hashes of an integer array, standing in for hashed distinct values
+    '''
+    x = np.asarray(x, dtype=np.uint64) + np.uint64(0x9e3779b97f4a7c15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def build(p, k_len, start, stop, chunk_size=2**20):
+    '''
+    Returns a HyperLogLog of the distinct items start..stop-1, added by hash in chunks
+    '''
+    hll = HyperLogLog(error_rate(p), k_len)
+    for i in range(start, stop, chunk_size):
+        hll.add_hashes(splitmix64(np.arange(i, min(i + chunk_size, stop), dtype=np.uint64)))
+    return hll
+
+def time_op(setup, run, repeat=3, min_time=0.05):
+    '''
+    Returns the best seconds per call of run(setup()) over repeat rounds of at least min_time seconds each
+
+    Every call gets a fresh setup(), which is not timed.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        calls = 0
+        elapsed = 0.0
+        while True:
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            elapsed += time.perf_counter() - start
+            calls += 1
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+def peak_memory(setup, run):
+    '''
+    Returns the peak bytes allocated by one call of run(setup()), not counting setup, as seen by tracemalloc
+    '''
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def max_rss():
+    '''
+    Returns the peak resident set size of the process in bytes so far, or None where unknown
+    '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def get_case(op, p, k_len, n, sketches):
+    '''
+    Returns (setup, run, items) for one op on sketches of cardinality n
+
+    run(setup()) does the op once and handles items items; setup gives the ops that change
+    a sketch a fresh copy, so that every timed call does the same work. sketches is a tuple
+    (a, b) of two sketches of n distinct items overlapping by half.
+    '''
+    e = error_rate(p)
+    a, b = sketches
+    data = a.to_bytes()
+    copy = lambda: HyperLogLog.from_bytes(data)
+    none = lambda: None
+    if op == 'construct':
+        return none, (lambda state: HyperLogLog(e, k_len)), 1
+    if op == 'add':
+        values = [str(i) for i in range(2 * n, 2 * n + 1000)]
+        def run(hll):
+            for value in values:
+                hll.add(value)
+        return copy, run, len(values)
+    if op == 'add_many':
+        values = [str(i) for i in range(2 * n, 2 * n + min(n, 2**16))]
+        return copy, (lambda hll: hll.add_many(values)), len(values)
+    if op == 'update':
+        return copy, (lambda hll: hll.update(b)), 1
+    if op == 'card':
+        def setup():
+            a._card = None # card() is cached until the counter changes
+            return a
+        return setup, (lambda hll: hll.card()), 1
+    if op == 'serialize':
+        return none, (lambda state: a.serialize()), 1
+    if op == 'deserialize':
+        serialized = a.serialize()
+        return (lambda: HyperLogLog(e, k_len)), (lambda hll: hll.setstate_from_serialization(serialized)), 1
+    if op == 'to_bytes':
+        return none, (lambda state: a.to_bytes()), 1
+    if op == 'from_bytes':
+        return none, (lambda state: HyperLogLog.from_bytes(data)), 1
+    if op == 'corrected_jaccard':
+        return none, (lambda state: HyperLogLog.get_corrected_jaccard([a, b])), 1
+    raise ValueError('Unknown operation %r' % op)
+
+def run_benchmarks(precisions, minhash_lens, cardinalities, operations=OPERATIONS, repeat=3, min_time=0.05, log=None):
+    '''
+    Benchmarks operations over every precision, minhash counter length and cardinality
+
+    Returns a list of result dicts with the seconds per call, items per second, tracemalloc
+    peak of one call and process peak RSS. construct does not depend on the cardinality and
+    is reported once per precision and minhash counter length, with n = 0.
+    '''
+    results = []
+    for p in precisions:
+        for k_len in minhash_lens:
+            for i, n in enumerate(cardinalities):
+                ops = [op for op in operations if op != 'construct' or i == 0]
+                if not ops:
+                    continue
+                sketches = (build(p, k_len, 0, n), build(p, k_len, n // 2, n // 2 + n))
+                for op in ops:
+                    setup, run, items = get_case(op, p, k_len, n, sketches)
+                    seconds = time_op(setup, run, repeat, min_time)
+                    result = {'op': op, 'p': p, 'k_len': k_len, 'n': 0 if op == 'construct' else n,
+                              'seconds': seconds, 'items_per_sec': items / seconds,
+                              'peak_bytes': peak_memory(setup, run), 'max_rss': max_rss()}
+                    results.append(result)
+                    if log:
+                        print('%(op)-18s p=%(p)-2d k_len=%(k_len)-6d n=%(n)-10d %(seconds).3es %(items_per_sec).3e items/s %(peak_bytes)d B' % result, file=log)
+    return results
+
+def result_key(result):
+    return (result['op'], result['p'], result['k_len'], result['n'])
+
+def compare(results, baseline, threshold=0.2):
+    '''
+    Returns the regressions of results against baseline results, as dicts
+
+    A case regresses when its seconds or peak_bytes exceed the baseline by more than threshold,
+    as a fraction. Cases missing from the baseline are ignored.
+    '''
+    baseline = dict((result_key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if old[metric] and result[metric] > old[metric] * (1 + threshold):
+                regressions.append({'op': result['op'], 'p': result['p'], 'k_len': result['k_len'], 'n': result['n'],
+                                    'metric': metric, 'baseline': old[metric], 'value': result[metric],
+                                    'ratio': result[metric] / old[metric]})
+    return regressions
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m drac.benchmark', description='Benchmark HyperLogLog operations')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick', help='grid of precisions, minhash lengths and cardinalities')
+    parser.add_argument('-p', '--precisions', type=int, nargs='+', help='override the profile precisions')
+    parser.add_argument('-k', '--minhash-lens', type=int, nargs='+', help='override the profile minhash counter lengths')
+    parser.add_argument('-n', '--cardinalities', type=int, nargs='+', help='override the profile cardinalities')
+    parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--repeat', type=int, default=3, help='timing rounds per case, the best is kept')
+    parser.add_argument('--min-time', type=float, default=0.05, help='minimum seconds per timing round')
+    parser.add_argument('-o', '--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown or memory growth, as a fraction')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress on stderr')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    grid = dict(PROFILES[args.profile])
+    for name in ('precisions', 'minhash_lens', 'cardinalities'):
+        if getattr(args, name):
+            grid[name] = getattr(args, name)
+    results = run_benchmarks(operations=args.ops, repeat=args.repeat, min_time=args.min_time,
+                             log=None if args.quiet else sys.stderr, **grid)
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+              'grid': grid, 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f)['results'], args.threshold)
+        for r in report['regressions']:
+            print('REGRESSION %(op)s p=%(p)d k_len=%(k_len)d n=%(n)d %(metric)s %(baseline).3g -> %(value).3g (x%(ratio).2f)' % r, file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    return 1 if report.get('regressions') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+This module implements the drac command line: streaming ingestion of large files into a sketch store,
+merging stores, querying cardinalities and intersections and serving sketches
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import itertools
+import sys
+import time
+from .hll import HyperLogLog
+from .group import HyperLogLogGroup
+from .store import SketchStore
+
+
+def open_input(path, text):
+    '''
+    Opens a plain or gzipped (by extension) input file, or stdin for '-'
+    '''
+    if path == '-':
+        return sys.stdin if text else sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt' if text else 'rb', encoding='utf-8' if text else None, newline='' if text else None)
+    return open(path, 'r', encoding='utf-8', newline='') if text else open(path, 'rb')
+
+def iter_chunks(paths, args):
+    '''
+    Yields (keys, values, rows) chunks of the input files
+
+    Plain lines are read about args.chunk_bytes at a time, CSV rows args.chunk_rows at a time
+    from one csv.reader, so quoted fields may span lines. keys is None unless grouping.
+    Empty values are skipped; rows counts the lines or rows read, skipped ones included.
+    With args.header the first line of every file is skipped in either mode.
+    '''
+    text = args.column is not None or args.group_by is not None
+    for path in paths:
+        f = open_input(path, text)
+        try:
+            if not text:
+                if args.header:
+                    f.readline()
+                while True:
+                    lines = f.readlines(args.chunk_bytes)
+                    if not lines:
+                        break
+                    values = [line.rstrip(b'\r\n') for line in lines]
+                    yield None, [v for v in values if v], len(lines)
+                continue
+
+            reader = csv.reader(f, delimiter=args.delimiter)
+            value_column, key_column = args.column or 0, args.group_by
+            if args.header:
+                header = next(reader, [])
+                value_column = get_column(header, value_column)
+                key_column = None if key_column is None else get_column(header, key_column)
+            else:
+                value_column = int(value_column)
+                key_column = None if key_column is None else int(key_column)
+            while True:
+                rows = list(itertools.islice(reader, args.chunk_rows))
+                if not rows:
+                    break
+                n_rows = len(rows)
+                rows = [row for row in rows if len(row) > value_column and row[value_column]]
+                values = [row[value_column] for row in rows]
+                keys = None if key_column is None else [row[key_column] if len(row) > key_column else '' for row in rows]
+                yield keys, values, n_rows
+        finally:
+            if f not in (sys.stdin, getattr(sys.stdin, 'buffer', None)):
+                f.close()
+
+def get_column(header, column):
+    '''
+    Returns the index of a column given by name or number
+    '''
+    if column in header:
+        return header.index(column)
+    try:
+        return int(column)
+    except ValueError:
+        raise SystemExit('drac: no column %r in the header' % column)
+
+def ingest(args):
+    start = time.time()
+    rows = 0
+    if args.group_by is None:
+        hll = HyperLogLog(args.error_rate, args.minhash_len)
+    else:
+        group = HyperLogLogGroup(args.error_rate, args.minhash_len)
+    last_report = start
+    for keys, values, n_rows in iter_chunks(args.inputs, args):
+        if keys is None:
+            hll.add_many(values)
+        else:
+            group.add_many(keys, values)
+        rows += n_rows
+        if args.progress and time.time() - last_report > args.progress:
+            last_report = time.time()
+            print('%d rows, %.0f rows/sec' % (rows, rows / (last_report - start)), file=sys.stderr)
+
+    with SketchStore(args.output) as store:
+        store.append_many(group.items() if args.group_by is not None else [(args.key, hll)])
+    elapsed = time.time() - start
+    print('%d rows in %.1f s, %.0f rows/sec, %d sketches written to %s' % (
+        rows, elapsed, rows / elapsed if elapsed else 0, len(group) if args.group_by is not None else 1, args.output), file=sys.stderr)
+
+def merge(args):
+    sketches = {}
+    for path in args.inputs:
+        with SketchStore(path, readonly=True) as store:
+            for key, hll in store.items():
+                sketches.setdefault(args.into or key, []).append(hll)
+    with SketchStore(args.output) as store:
+        store.append_many((key, HyperLogLog.union_many(hlls)) for key, hlls in sketches.items())
+
+def card(args):
+    with SketchStore(args.store, readonly=True) as store:
+        for key in args.keys or list(store):
+            if key not in store:
+                raise SystemExit('drac: no sketch %r in %s' % (key, args.store))
+            print('%s\t%d' % (key, round(store[key].card())))
+
+def jaccard(args):
+    with SketchStore(args.store, readonly=True) as store:
+        missing = [key for key in args.keys if key not in store]
+        if missing:
+            raise SystemExit('drac: no sketch %r in %s' % (missing[0], args.store))
+        hlls = [store[key] for key in args.keys]
+        print('jaccard\t%f' % HyperLogLog.get_corrected_jaccard(hlls))
+        print('intersection\t%d' % HyperLogLog.get_intersection_card(hlls))
+
+def serve(args):
+    from .server import SketchServer
+    server = SketchServer(args.host, args.port, args.snapshot, args.snapshot_interval,
+                          error_rate=args.error_rate, minhash_counter_len=args.minhash_len)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='drac', description='HyperLogLog sketches of large files')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('ingest', help='stream files into sketches')
+    p.add_argument('inputs', nargs='+', help='input files, gzipped if ending in .gz, - for stdin')
+    p.add_argument('-o', '--output', required=True, help='sketch store to write')
+    p.add_argument('-c', '--column', help='CSV column (name or 0 based number) of the values; without it every line is a value')
+    p.add_argument('-g', '--group-by', help='CSV column (name or number) of the key, one sketch per key')
+    p.add_argument('-d', '--delimiter', default=',', help='CSV delimiter')
+    p.add_argument('--header', action='store_true', help='the first line of every file is a header, skipped for plain lines')
+    p.add_argument('-k', '--key', default='all', help='key of the sketch when not grouping')
+    p.add_argument('-e', '--error-rate', type=float, default=0.01)
+    p.add_argument('-m', '--minhash-len', type=int, default=2**16, help='minhash counter length')
+    p.add_argument('--chunk-bytes', type=int, default=2**24, help='bytes read per chunk of plain lines')
+    p.add_argument('--chunk-rows', type=int, default=2**18, help='rows read per chunk of CSV')
+    p.add_argument('--progress', type=float, default=0, help='report rows/sec every this many seconds')
+    p.set_defaults(func=ingest)
+
+    p = commands.add_parser('merge', help='merge the sketches of several stores by key')
+    p.add_argument('inputs', nargs='+', help='sketch stores')
+    p.add_argument('-o', '--output', required=True, help='sketch store to write')
+    p.add_argument('--into', help='merge all sketches into this single key')
+    p.set_defaults(func=merge)
+
+    p = commands.add_parser('card', help='print cardinalities')
+    p.add_argument('store')
+    p.add_argument('keys', nargs='*', help='keys to print, all by default')
+    p.set_defaults(func=card)
+
+    p = commands.add_parser('jaccard', help='print the jaccard index and intersection cardinality of sketches')
+    p.add_argument('store')
+    p.add_argument('keys', nargs='+')
+    p.set_defaults(func=jaccard)
+
+    p = commands.add_parser('serve', help='serve named sketches over TCP, see drac.server')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=7379)
+    p.add_argument('-s', '--snapshot', help='sketch store loaded at start and snapshotted to')
+    p.add_argument('--snapshot-interval', type=float, default=60, help='seconds between snapshots')
+    p.add_argument('-e', '--error-rate', type=float, default=0.01)
+    p.add_argument('-m', '--minhash-len', type=int, default=2**16, help='minhash counter length')
+    p.set_defaults(func=serve)
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
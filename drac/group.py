@@ -0,0 +1,311 @@
+"""
+This module implements a keyed collection of HyperLogLog counters for GROUP BY key COUNT(DISTINCT value)
+"""
+
+import numpy as np
+from .hll import HyperLogLog, hash_batch, iter_batches, encode_sparse_array, merge_sparse_entries, decode_sparse_array, get_rho_array, sparse_estimate
+from .minhash import BottomK
+
+_low32 = np.uint64(0xffffffff)
+_shift32 = np.uint64(32)
+
+def bottom_k_by_group(ids, hashes, k):
+    '''
+    Returns the (ids, hashes) pairs of the k smallest distinct hashes of every id, sorted by id then hash
+    '''
+    # sort by id and the high hash bits in one argsort; ties of the high bits are rare and
+    # only then is the slower lexsort needed
+    key = (ids.astype(np.uint64) << _shift32) | (hashes >> _shift32)
+    order = np.argsort(key)
+    ids, hashes, key = ids[order], hashes[order], key[order]
+    if np.any((key[1:] == key[:-1]) & (hashes[1:] < hashes[:-1])):
+        order = np.lexsort((hashes, ids))
+        ids, hashes = ids[order], hashes[order]
+    distinct = np.ones(len(ids), dtype=bool)
+    distinct[1:] = (ids[1:] != ids[:-1]) | (hashes[1:] != hashes[:-1])
+    ids, hashes = ids[distinct], hashes[distinct]
+    # rank of every hash within its id
+    position = np.arange(len(ids))
+    starts = np.ones(len(ids), dtype=bool)
+    starts[1:] = ids[1:] != ids[:-1]
+    rank = position - np.maximum.accumulate(np.where(starts, position, 0))
+    keep = rank < k
+    return ids[keep], hashes[keep]
+
+
+class HyperLogLogGroup(object):
+    """
+    Collection of HyperLogLog counters, one per key, sharing error_rate and minhash_counter_len
+    """
+
+    def __init__(self, error_rate=0.01, minhash_counter_len=2**16):
+        """
+        Creates an empty group
+
+        Apart from looking up group ids, batches are added without Python work per group.
+        Small groups keep sparse entries like a sparse HyperLogLog, all of them in one sorted
+        array keyed by group id; new entries are buffered and merged in one vectorized pass
+        once the buffer outgrows the merged entries, like HyperLogLog.tmp. Once a group would
+        take more memory sparse than dense it gets a row in one 2D uint8 register array shared
+        by all dense groups. The bottom-k minhash values of all groups are kept the same way,
+        sorted by group id then hash, and every batch is first cut against the k-th smallest
+        hash of the full groups.
+        """
+        template = HyperLogLog(error_rate, minhash_counter_len)
+        self.error_rate = error_rate
+        self.k_len = minhash_counter_len
+        self.p = template.p
+        self.m = template.m
+        self.ids = {} # key -> group id
+        self.names = [] # group id -> key
+        # per group id arrays, grown by doubling
+        self.rows = np.empty(0, dtype=np.intp) # row in registers, -1 while the group is sparse
+        self.full = np.empty(0, dtype=bool) # the group holds minhash_counter_len minhash values
+        self.thresholds = np.empty(0, dtype=np.uint64) # largest minhash value of full groups
+        self.registers = np.zeros((0, self.m), dtype=np.uint8)
+        self.n_rows = 0
+        self.sparse = np.empty(0, dtype=np.uint64) # sorted (group id << 32) | sparse entry of sparse groups
+        self.sparse_tmp = [] # arrays of such entries not yet merged
+        self.sparse_tmp_len = 0
+        self.minhash_ids = np.empty(0, dtype=np.intp) # group ids of the minhash values, sorted
+        self.minhash = np.empty(0, dtype=np.uint64) # minhash values, sorted within every group
+        self.minhash_tmp = [] # (group ids, hashes) pairs not yet merged
+        self.minhash_tmp_len = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def _group_ids(self, keys):
+        """
+        Returns the array of group ids of keys, creating the missing groups
+        """
+        gids = list(map(self.ids.get, keys))
+        for i, g in enumerate(gids):
+            if g is None:
+                g = gids[i] = self.ids.setdefault(keys[i], len(self.names))
+                if g == len(self.names):
+                    self.names.append(keys[i])
+        if len(self.names) > len(self.rows):
+            size = max(16, 2 * len(self.rows), len(self.names))
+            grow = lambda a, fill: np.concatenate([a, np.full(size - len(a), fill, dtype=a.dtype)])
+            self.rows = grow(self.rows, -1)
+            self.full = grow(self.full, False)
+            self.thresholds = grow(self.thresholds, 0)
+        return np.array(gids, dtype=np.intp)
+
+    def _new_rows(self, n):
+        """
+        Returns the indexes of n new rows of the register array
+        """
+        if self.n_rows + n > len(self.registers):
+            # grow the register array by doubling
+            registers = np.zeros((max(16, 2 * len(self.registers), self.n_rows + n), self.m), dtype=np.uint8)
+            registers[:self.n_rows] = self.registers[:self.n_rows]
+            self.registers = registers
+        self.n_rows += n
+        return np.arange(self.n_rows - n, self.n_rows)
+
+    def _buffer_sparse(self, gid, entries):
+        if len(gid):
+            self.sparse_tmp.append((gid.astype(np.uint64) << _shift32) | entries.astype(np.uint64))
+            self.sparse_tmp_len += len(gid)
+            if self.sparse_tmp_len > max(len(self.sparse), 2**16):
+                self._merge_sparse()
+
+    def _merge_sparse(self):
+        """
+        Merges the buffered sparse entries, giving the groups that grew too big a dense row
+        """
+        if not self.sparse_tmp:
+            return
+        self.sparse = merge_sparse_entries(self.sparse, *self.sparse_tmp, dtype=np.uint64)
+        self.sparse_tmp = []
+        self.sparse_tmp_len = 0
+        # sparse entries take 4 bytes, dense registers 1 byte each
+        counts = np.bincount((self.sparse >> _shift32).astype(np.intp), minlength=len(self.names))
+        self._to_dense(np.flatnonzero(4 * counts > self.m))
+
+    def _to_dense(self, gids):
+        """
+        Moves the merged sparse entries of groups gids to new rows of the register array
+        """
+        if not len(gids):
+            return
+        self.rows[gids] = self._new_rows(len(gids))
+        entry_rows = self.rows[(self.sparse >> _shift32).astype(np.intp)]
+        moved = entry_rows >= 0
+        j, rho = decode_sparse_array(self.sparse[moved] & _low32, self.p)
+        np.maximum.at(self.registers, (entry_rows[moved], j), rho)
+        self.sparse = self.sparse[~moved]
+
+    def _buffer_minhash(self, gid, x):
+        """
+        Buffers the hashes x of groups gid that are below the threshold of their group
+        """
+        keep = ~self.full[gid] | (x < self.thresholds[gid])
+        gid, x = gid[keep], x[keep]
+        if len(gid):
+            self.minhash_tmp.append((gid, x))
+            self.minhash_tmp_len += len(gid)
+            if self.minhash_tmp_len > max(len(self.minhash), 2**16):
+                self._merge_minhash()
+
+    def _merge_minhash(self):
+        if not self.minhash_tmp:
+            return
+        ids, hashes = zip(*self.minhash_tmp)
+        self.minhash_ids, self.minhash = bottom_k_by_group(np.concatenate((self.minhash_ids,) + ids),
+                                                           np.concatenate((self.minhash,) + hashes), self.k_len)
+        self.minhash_tmp = []
+        self.minhash_tmp_len = 0
+        # the last value of every group that holds k_len of them is its new threshold
+        ends = np.flatnonzero(np.r_[self.minhash_ids[1:] != self.minhash_ids[:-1], True])
+        starts = np.r_[0, ends[:-1] + 1]
+        full = ends[ends - starts + 1 == self.k_len]
+        self.full[self.minhash_ids[full]] = True
+        self.thresholds[self.minhash_ids[full]] = self.minhash[full]
+
+    def add(self, key, value):
+        """
+        Adds value to the counter of key
+        """
+        self.add_many([key], [value])
+
+    def add_many(self, keys, values, batch_size=2**16):
+        """
+        Adds values[i] to the counter of keys[i] for every i, in vectorized batches
+
+        keys and values are sequences or NumPy arrays of the same length; values are
+        hashed like HyperLogLog.add_many.
+        """
+        if len(keys) != len(values):
+            raise ValueError('keys and values should have the same length')
+        for key_batch, value_batch in zip(iter_batches(keys, batch_size), iter_batches(values, batch_size)):
+            if len(key_batch):
+                self.add_hashes(key_batch, hash_batch(value_batch))
+
+    def add_hashes(self, keys, x):
+        """
+        Adds items by their unsigned 64 bit hashes (see hash_values) to the counters of keys
+
+        keys is a 1-D NumPy array or a sequence of any hashable keys, such as tuples.
+        """
+        x = np.asarray(x, dtype=np.uint64)
+        if isinstance(keys, np.ndarray) and keys.ndim == 1 and keys.dtype != object:
+            uniq, inverse = np.unique(keys, return_inverse=True)
+            gid = self._group_ids(uniq.tolist())[inverse.ravel()]
+        else:
+            # tuples or mixed types would not survive a conversion to an array
+            gid = self._group_ids(list(keys))
+        if len(gid) != len(x):
+            raise ValueError('keys and hashes should have the same length')
+        rows = self.rows[gid]
+
+        # dense groups: one scatter-max into the shared register array
+        dense = rows >= 0
+        if dense.any():
+            xd = x[dense]
+            j = (xd & np.uint64(self.m - 1)).astype(np.intp)
+            rho = get_rho_array(xd >> np.uint64(self.p), 64 - self.p)
+            np.maximum.at(self.registers, (rows[dense], j), rho)
+
+        # sparse groups: buffered entries
+        if not dense.all():
+            self._buffer_sparse(gid[~dense], encode_sparse_array(x[~dense]))
+        self._buffer_minhash(gid, x)
+
+    def update(self, other):
+        """
+        Merges the counters of another group into this one, key by key
+        """
+        if self.m != other.m:
+            raise ValueError('Counters precisions should be equal')
+        other._merge_sparse()
+        other._merge_minhash()
+        self._merge_sparse()
+        gmap = self._group_ids(other.names) # group id in other -> group id in self
+
+        # dense on the other side: dense here too, then one vectorized row-wise max
+        other_dense = np.flatnonzero(other.rows[:len(other)] >= 0)
+        if len(other_dense):
+            targets = gmap[other_dense]
+            self._to_dense(targets[self.rows[targets] < 0])
+            rows = self.rows[targets]
+            self.registers[rows] = np.maximum(self.registers[rows], other.registers[other.rows[other_dense]])
+
+        # sparse on the other side: scattered into dense groups, buffered for sparse ones
+        targets = gmap[(other.sparse >> _shift32).astype(np.intp)]
+        entries = other.sparse & _low32
+        rows = self.rows[targets]
+        dense = rows >= 0
+        if dense.any():
+            j, rho = decode_sparse_array(entries[dense], self.p)
+            np.maximum.at(self.registers, (rows[dense], j), rho)
+        self._buffer_sparse(targets[~dense], entries[~dense])
+
+        if len(other.minhash):
+            self._buffer_minhash(gmap[other.minhash_ids], other.minhash)
+
+    def __getitem__(self, key):
+        """
+        Exports the counter of key as a standalone HyperLogLog
+        """
+        return self._export(self.ids[key])
+
+    def _sparse_range(self, g):
+        """
+        Returns the slice of the merged sparse entries of group g
+        """
+        lo, hi = np.searchsorted(self.sparse, np.array([g, g + 1], dtype=np.uint64) << _shift32)
+        return slice(lo, hi)
+
+    def _export(self, g, minhash=True):
+        self._merge_sparse()
+        hll = HyperLogLog(self.error_rate, self.k_len)
+        if self.rows[g] < 0:
+            hll.S = (self.sparse[self._sparse_range(g)] & _low32).astype(np.uint32)
+        else:
+            hll.M = bytearray(self.registers[self.rows[g]].tobytes())
+            hll.S = None
+        hll._count_registers()
+        if minhash:
+            self._merge_minhash()
+            lo, hi = np.searchsorted(self.minhash_ids, [g, g + 1])
+            hll.k = BottomK(self.k_len)
+            hll.k.values = self.minhash[lo:hi].copy()
+            hll.k._set_threshold()
+        return hll
+
+    def items(self):
+        for key in self.names:
+            yield key, self[key]
+
+    def card(self, key):
+        """
+        Returns the estimated number of distinct values of key
+        """
+        g = self.ids[key]
+        self._merge_sparse()
+        if self.rows[g] < 0:
+            r = self._sparse_range(g)
+            return sparse_estimate(r.stop - r.start)
+        return self._export(g, minhash=False).card()
+
+    def cards(self):
+        """
+        Returns a dict of the estimated number of distinct values of every key
+        """
+        self._merge_sparse()
+        counts = np.bincount((self.sparse >> _shift32).astype(np.intp), minlength=len(self.names)).tolist()
+        rows = self.rows.tolist()
+        return dict((key, sparse_estimate(counts[g]) if rows[g] < 0 else self._export(g, minhash=False).card())
+                    for g, key in enumerate(self.names))
@@ -3,12 +3,18 @@ This module implements probabilistic data structure which is able to calculate t
 """
 
 import math
-from .const import rawEstimateData, biasData, tresholdData
+import bisect
+import functools
 import mmh3
 import zlib
 import pickle
 import base64
-from sortedcontainers import SortedSet
+import io
+import struct
+import multiprocessing
+import itertools
+import numpy as np
+from .minhash import BottomK
 
 def max_min(x):
     return sum(x) - min(x)
@@ -24,17 +30,30 @@ if not hasattr(int, 'bit_length'):
     bit_length = bit_length_emu
 
 def get_treshold(p):
+    from .const import tresholdData
     return tresholdData[p - 4]
 
+@functools.lru_cache(maxsize=None)
+def get_bias_tables(p):
+    '''
+    Returns the raw estimate and bias vectors of precision p as tuples of floats
+
+    The tables in const are only imported, and converted one precision at a time, on first use.
+    '''
+    from .const import rawEstimateData, biasData
+    return tuple(map(float, rawEstimateData[p - 4])), tuple(map(float, biasData[p - 4]))
+
 def estimate_bias(E, p):
-    bias_vector = biasData[p - 4]
-    nearest_neighbors = get_nearest_neighbors(E, rawEstimateData[p - 4])
-    return sum([float(bias_vector[i]) for i in nearest_neighbors]) / len(nearest_neighbors)
+    estimate_vector, bias_vector = get_bias_tables(p)
+    nearest_neighbors = get_nearest_neighbors(E, estimate_vector)
+    return sum([bias_vector[i] for i in nearest_neighbors]) / len(nearest_neighbors)
 
-def get_nearest_neighbors(E, estimate_vector):
-    distance_map = [((E - float(val)) ** 2, idx) for idx, val in enumerate(estimate_vector)]
-    distance_map.sort()
-    return [idx for dist, idx in distance_map[:6]]
+def get_nearest_neighbors(E, estimate_vector, k=6):
+    # the estimate vectors are increasing apart from a few small dips, so the k nearest
+    # neighbors lie in a small window around the insertion point of E
+    i = bisect.bisect_left(estimate_vector, E)
+    window = range(max(0, i - k - 2), min(len(estimate_vector), i + k + 2))
+    return sorted(window, key=lambda idx: ((E - float(estimate_vector[idx])) ** 2, idx))[:k]
 
 def get_alpha(p):
     if not (4 <= p <= 16):
@@ -53,19 +72,219 @@ def get_rho(w, max_width):
         raise ValueError('w overflow')
     return rho
 
+def bit_length_array(w):
+    '''
+    Vectorized bit_length of an array of uint64 values (binary search on the highest set bit)
+    '''
+    w = np.asarray(w, dtype=np.uint64)
+    n = np.zeros(w.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = w >> np.uint64(shift)
+        mask = high != 0
+        n[mask] += shift
+        w = np.where(mask, high, w)
+    return n + (w != 0)
+
+def get_rho_array(w, max_width):
+    '''
+    Vectorized get_rho for an array of uint64 values
+    '''
+    rho = max_width - bit_length_array(w) + 1
+    if (rho <= 0).any():
+        raise ValueError('w overflow')
+    return rho.astype(np.uint8)
+
+def pack_registers(M):
+    '''
+    Packs uint8 registers into the 6 bit dense form (4 registers per 3 bytes)
+    '''
+    r = np.frombuffer(M, dtype=np.uint8).reshape(-1, 4).astype(np.uint32)
+    v = r[:, 0] | (r[:, 1] << 6) | (r[:, 2] << 12) | (r[:, 3] << 18)
+    packed = np.empty((len(v), 3), dtype=np.uint8)
+    packed[:, 0] = v & 0xff
+    packed[:, 1] = (v >> 8) & 0xff
+    packed[:, 2] = v >> 16
+    return packed.tobytes()
+
+def unpack_registers(packed):
+    '''
+    Unpacks registers produced by pack_registers into a bytearray
+    '''
+    b = np.frombuffer(packed, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+    M = np.empty((len(v), 4), dtype=np.uint8)
+    for i in range(4):
+        M[:, i] = (v >> (6 * i)) & 0x3f
+    return bytearray(M.tobytes())
+
+# internal precision of the sparse representation (HLL++)
+SPARSE_P = 25
+
+def encode_sparse(x):
+    '''
+    Encodes a 64 bit hash as a sparse entry: the SPARSE_P bit index and its rho in the low 6 bits
+    '''
+    j = x & ((1 << SPARSE_P) - 1)
+    return (j << 6) | get_rho(x >> SPARSE_P, 64 - SPARSE_P)
+
+def encode_sparse_array(x):
+    '''
+    Vectorized encode_sparse for an array of uint64 hashes
+    '''
+    j = x & np.uint64((1 << SPARSE_P) - 1)
+    rho = get_rho_array(x >> np.uint64(SPARSE_P), 64 - SPARSE_P)
+    return ((j << np.uint64(6)) | rho).astype(np.uint32)
+
+def merge_sparse_entries(*parts, dtype=np.uint32):
+    '''
+    Merges arrays of sparse entries into a sorted array holding the max rho of every index
+
+    With dtype=np.uint64 the entries may carry a prefix above their low 32 bits, such as the
+    group id of HyperLogLogGroup; the max rho is then kept per prefix and index.
+    '''
+    S = np.sort(np.concatenate([np.asarray(i, dtype=dtype) for i in parts]))
+    if len(S):
+        # entries sort by index then rho, so the last entry of every index holds its max;
+        # this also drops duplicates, and sorting is much faster than np.unique on NumPy 2
+        keep = np.ones(len(S), dtype=bool)
+        keep[:-1] = (S[1:] >> 6) != (S[:-1] >> 6)
+        S = S[keep]
+    return S
+
+def sparse_estimate(s):
+    '''
+    Returns the linear counting estimate of s sparse entries over the 2 ** SPARSE_P sparse registers
+    '''
+    m = 1 << SPARSE_P
+    return m * math.log(m / float(m - s))
+
+def decode_sparse_array(S, p):
+    '''
+    Returns the dense register indexes of precision p and the rho values of sparse entries
+    '''
+    S = np.asarray(S, dtype=np.uint32)
+    j = (S >> 6).astype(np.uint64)
+    rho = (S & 0x3f).astype(np.uint8)
+    # rho overflows the sparse width when the remaining hash bits are all zero; the dense
+    # rho then also counts the index bits above p
+    overflow = rho > 64 - SPARSE_P
+    rho[overflow] = get_rho_array(j[overflow] >> np.uint64(p), 64 - p)
+    return (j & np.uint64((1 << p) - 1)).astype(np.intp), rho
+
+def sparse_to_dense(S, p):
+    '''
+    Converts sparse entries to the dense registers of precision p
+    '''
+    M = bytearray(1 << p)
+    np.maximum.at(np.frombuffer(M, dtype=np.uint8), *decode_sparse_array(S, p))
+    return M
+
+class LegacySortedSet(list):
+    '''
+    Stand-in for the sortedcontainers SortedSet pickled in the minhash counter of older serializations
+    '''
+
+    def __init__(self, iterable=(), key=None):
+        list.__init__(self, sorted(iterable))
+
+class LegacyUnpickler(pickle.Unpickler):
+    '''
+    Unpickler of serialize strings that loads older ones without sortedcontainers installed
+    '''
+
+    def find_class(self, module, name):
+        if (module, name) in (('sortedcontainers.sortedset', 'SortedSet'), ('sortedcontainers', 'SortedSet')):
+            return LegacySortedSet
+        # serialize strings only reference these; refuse anything else a crafted pickle could call
+        if (module, name) in (('drac.minhash', 'BottomK'), ('builtins', 'set'), ('builtins', 'frozenset')):
+            return pickle.Unpickler.find_class(self, module, name)
+        raise pickle.UnpicklingError('Unexpected %s.%s in a serialized HyperLogLog' % (module, name))
+
+# Binary format written by HyperLogLog.to_bytes (version 1, little endian):
+#
+#   offset  size  field
+#   0       4     magic b'DRAC'
+#   4       1     version
+#   5       1     flags: FLAG_SPARSE | FLAG_PACKED | FLAG_COMPRESSED
+#   6       1     p
+#   7       1     reserved, 0
+#   8       8     error_rate, float64
+#   16      4     k_len, uint32
+#   20      4     number of minhash values n, uint32
+#   24      4     number of sparse entries s, uint32 (0 for dense counters)
+#   28      4     reserved, 0
+#   32            payload, zlib compressed as a whole when FLAG_COMPRESSED is set:
+#                 registers: 2 ** p uint8, or 3 * 2 ** (p - 2) bytes in the 6 bit packed
+#                            form when FLAG_PACKED is set; for sparse counters s uint32
+#                            sorted sparse entries instead (see encode_sparse)
+#                 minhash:   n uint64, the first hash followed by the deltas between
+#                            consecutive sorted hashes
+BINARY_MAGIC = b'DRAC'
+BINARY_VERSION = 1
+FLAG_SPARSE = 1
+FLAG_PACKED = 2
+FLAG_COMPRESSED = 4
+binary_header = struct.Struct('<4sBBBxdIII4x')
+
+# 2 ** -rho for every possible register value
+_inverse_powers = np.ldexp(1.0, -np.arange(64))
+
+def iter_batches(values, batch_size):
+    '''
+    Splits a NumPy array, sequence or any iterable into batches of at most batch_size items
+    '''
+    if isinstance(values, (np.ndarray, list, tuple)):
+        for start in range(0, len(values), batch_size):
+            yield values[start:start + batch_size]
+    else:
+        values = iter(values)
+        while True:
+            batch = list(itertools.islice(values, batch_size))
+            if not batch:
+                return
+            yield batch
+
+def hash_batch(values):
+    '''
+    Hashes a batch of values with the same 64 bit murmurhash used by HyperLogLog.add
+
+    Integer NumPy arrays are hashed through their decimal string representation,
+    i.e. the same as adding str(value).
+    '''
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind in 'iub':
+            values = [str(v) for v in values.tolist()]
+        else:
+            values = values.tolist()
+    hash64 = mmh3.hash64
+    return np.fromiter((hash64(v, signed=False)[0] for v in values), dtype=np.uint64, count=len(values))
+
+def hash_values(values, batch_size=2**16):
+    '''
+    Returns the uint64 hashes HyperLogLog.add would compute for all values, as a NumPy array
+
+    The result can be fed to HyperLogLog.add_hashes of any number of counters, or stored and
+    shipped instead of the values themselves.
+    '''
+    batches = [hash_batch(batch) for batch in iter_batches(values, batch_size)]
+    return np.concatenate(batches) if batches else np.empty(0, dtype=np.uint64)
+
 
 class HyperLogLog(object):
     """
     HyperLogLog cardinality counter
     """
 
-    __slots__ = ('alpha', 'p', 'm', 'M', 'k', 'k_len', 'error_rate')
+    __slots__ = ('alpha', 'p', 'm', 'M', 'S', 'tmp', 'hist', '_card', 'k', 'k_len', 'error_rate')
 
-    def __init__(self, error_rate=0.01, minhash_counter_len=2**16):
+    def __init__(self, error_rate=0.01, minhash_counter_len=2**16, sparse=True):
         """
         Implementes a HyperLogLog
 
         error_rate = abs_err / cardinality
+
+        With sparse=True the counter starts in the HLL++ sparse representation and
+        converts itself to dense registers once that stops saving memory.
         """
 
         if not (0 < error_rate < 1):
@@ -80,17 +299,104 @@ class HyperLogLog(object):
         self.alpha = get_alpha(p)
         self.p = p
         self.m = 1 << p
-        self.M = [ 0 for i in range(self.m) ]
-        self.k = SortedSet( range( 2**64, 2**64 + minhash_counter_len ) ) #every register gets a unique placeholder value
+        if sparse:
+            self.M = None
+            self.S = np.empty(0, dtype=np.uint32) # sorted sparse entries, see encode_sparse
+        else:
+            self.M = bytearray(self.m) # one uint8 register per bucket
+            self.S = None
+        self.tmp = [] # sparse entries not yet merged into S
+        self.hist = [self.m] + [0] * 63 if self.M is not None else None # number of registers per rho value
+        self._card = None # cached card(), reset whenever the counter changes
+        self.k = BottomK(minhash_counter_len) # minhash counter of the k_len smallest hashes
         self.k_len = minhash_counter_len
         self.error_rate = error_rate
 
     def __getstate__(self):
-        return dict([x, getattr(self, x)] for x in self.__slots__)
+        d = dict([x, getattr(self, x)] for x in self.__slots__ if x not in ('M', 'S', 'tmp', 'hist', '_card'))
+        if self.M is None:
+            self._merge_sparse()
+        if self.M is None:
+            d['S'] = self.S.tobytes()
+        else:
+            d['M6'] = pack_registers(self.M) # registers are stored in the 6 bit packed form
+        return d
 
     def __setstate__(self, d):
+        self.M = None
+        self.S = None
+        self.tmp = []
         for key in d:
-            setattr(self, key, d[key])
+            if d[key] is None:
+                continue
+            if key == 'M6':
+                self.M = unpack_registers(d[key])
+            elif key == 'M':
+                self.M = bytearray(d[key]) # also accepts the list registers of older serializations
+            elif key == 'k' and not isinstance(d[key], BottomK):
+                # older serializations hold a SortedSet padded with placeholders >= 2 ** 64
+                self.k = BottomK(d['k_len'], [i for i in d[key] if i < 2**64])
+            elif key == 'S':
+                self.S = np.frombuffer(d[key], dtype=np.uint32).copy()
+            else:
+                setattr(self, key, d[key])
+        self._count_registers()
+
+    def is_sparse(self):
+        """
+        Returns True while the counter uses the sparse representation
+        """
+        return self.M is None
+
+    def _registers(self):
+        """
+        Returns a writable uint8 NumPy view of the dense registers
+        """
+        return np.frombuffer(self.M, dtype=np.uint8)
+
+    def _writable(self):
+        """
+        Copies registers that wrap a read-only buffer (see from_buffer) before they are changed
+        """
+        if not isinstance(self.M, bytearray):
+            self.M = bytearray(self.M)
+
+    def _count_registers(self):
+        """
+        Recounts the register histogram after the registers changed in bulk and resets the cached card
+        """
+        self.hist = np.bincount(self._registers(), minlength=64).tolist() if self.M is not None else None
+        self._card = None
+
+    def _dense_registers(self):
+        """
+        Returns the dense registers as a uint8 NumPy array, without converting a sparse counter
+        """
+        if self.M is None:
+            self._merge_sparse()
+        if self.M is None:
+            return np.frombuffer(sparse_to_dense(self.S, self.p), dtype=np.uint8)
+        return self._registers()
+
+    def _merge_sparse(self, *entries):
+        """
+        Merges pending and new sparse entries into S, converting to dense when S grows too big
+        """
+        self.S = merge_sparse_entries(self.S, self.tmp, *entries)
+        self.tmp = []
+        # sparse entries take 4 bytes, dense registers 1 byte each
+        if 4 * len(self.S) > self.m:
+            self._to_dense()
+
+    def _to_dense(self):
+        """
+        Switches a sparse counter to dense registers
+        """
+        if self.M is None:
+            self.M = sparse_to_dense(merge_sparse_entries(self.S, self.tmp), self.p)
+            self.S = None
+            self.tmp = []
+            self._count_registers()
 
     def add(self, value):
         """
@@ -102,16 +408,61 @@ class HyperLogLog(object):
         # w = <x_{p}x_{p+1}..>
         # M[j] = max(M[j], rho(w))
 
-        x = mmh3.hash64(value, signed=False)[0]
-        j = x & (self.m - 1)
-        w = x >> self.p
+        self.add_hash(mmh3.hash64(value, signed=False)[0])
 
-        self.M[j] = max(self.M[j], get_rho(w, 64 - self.p))
+    def add_hash(self, x):
+        """
+        Adds an item by its unsigned 64 bit hash, see hash_values
+        """
+        x = int(x) # also accepts NumPy scalars such as hash_values(values)[0]
+        if self.M is None:
+            self.tmp.append(encode_sparse(x))
+            self._card = None
+            if 4 * len(self.tmp) > self.m:
+                self._merge_sparse()
+        else:
+            j = x & (self.m - 1)
+            w = x >> self.p
+
+            old, new = self.M[j], get_rho(w, 64 - self.p)
+            if new > old:
+                self._writable()
+                self.M[j] = new
+                self.hist[old] -= 1
+                self.hist[new] += 1
+                self._card = None
+
+        # add to minhash counter too (k), which keeps at most k_len hashes
+        self.k.add(x)
+
+    def add_many(self, values, batch_size=2**16):
+        """
+        Adds all items of an iterable, list of str/bytes or NumPy array to the HyperLogLog
 
-        # add to minhash counter too (k) while keeping length constant
-        if x < self.k[-1]:
-            self.k.add(x)
-            self.k.pop();
+        Equivalent to calling add for every item, but hashes, computes rho and updates the
+        registers and the minhash counter in vectorized batches of batch_size items.
+        """
+        for batch in iter_batches(values, batch_size):
+            if len(batch):
+                self.add_hashes(hash_batch(batch))
+
+    def add_hashes(self, x):
+        """
+        Adds items by an array of their unsigned 64 bit hashes, see hash_values
+        """
+        x = np.asarray(x, dtype=np.uint64)
+        if self.M is None:
+            self._merge_sparse(encode_sparse_array(x))
+        else:
+            j = (x & np.uint64(self.m - 1)).astype(np.intp)
+            rho = get_rho_array(x >> np.uint64(self.p), 64 - self.p)
+
+            # scatter-max of rho into the registers
+            self._writable()
+            np.maximum.at(self._registers(), j, rho)
+        self._count_registers()
+
+        self.k.update(x)
 
     def update(self, *others):
         """
@@ -122,13 +473,63 @@ class HyperLogLog(object):
             if self.m != item.m:
                 raise ValueError('Counters precisions should be equal')
 
-        self.M = [max(*items) for items in zip(*([ item.M for item in others ] + [ self.M ]))]
-        self.k = SortedSet( SortedSet( [ *self.k, *[ i for item in others for i in item.k ] ] )[0:self.k_len] )
+        if self.M is None and all(item.M is None for item in others):
+            self._merge_sparse(*[i for item in others for i in (item.S, item.tmp)])
+        else:
+            self._to_dense()
+            self._writable()
+            M = self._registers()
+            for item in others:
+                np.maximum(M, item._dense_registers(), out=M)
+        self._count_registers()
+        self.k.update(*[item.k.sorted() for item in others])
+
+    @classmethod
+    def union_many(cls, sketches, tree=False):
+        """
+        Returns a new counter holding the union of sketches, leaving them unchanged
+
+        Registers are merged with a single max over the stacked registers and the minhash
+        counters with a lazy k-way merge that stops after k_len hashes. With tree=True the
+        sketches are instead merged pairwise, level by level, which bounds the memory used
+        by the stacked registers for very large inputs.
+        """
+        sketches = list(sketches)
+        if not sketches:
+            raise ValueError('At least one counter is required')
+        for item in sketches:
+            if sketches[0].m != item.m:
+                raise ValueError('Counters precisions should be equal')
+
+        if tree:
+            while len(sketches) > 2:
+                sketches = [cls.union_many(sketches[i:i + 2]) for i in range(0, len(sketches), 2)]
+            return cls.union_many(sketches)
+
+        new = cls._union_registers(sketches)
+        new.k = BottomK.union([item.k for item in sketches], new.k_len)
+        return new
+
+    @classmethod
+    def _union_registers(cls, sketches):
+        """
+        Returns a new counter with the union of the registers of sketches and an empty minhash counter
+        """
+        new = cls(sketches[0].error_rate, sketches[0].k_len)
+        sparse = [i for item in sketches if item.M is None for i in (item.S, item.tmp)]
+        if sparse:
+            new._merge_sparse(*sparse)
+        dense = [item._registers() for item in sketches if item.M is not None]
+        if dense:
+            new._to_dense()
+            np.max(np.stack(dense + [new._registers()]), axis=0, out=new._registers())
+            new._count_registers()
+        return new
 
     def __eq__(self, other):
         if self.m != other.m:
             raise ValueError('Counters precisions should be equal')
-        return self.M == other.M
+        return np.array_equal(self._dense_registers(), other._dense_registers())
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -137,16 +538,29 @@ class HyperLogLog(object):
         return round(self.card())
 
     def _Ep(self):
-        E = self.alpha * float(self.m ** 2) / sum(math.pow(2.0, -x) for x in self.M)
+        E = self.alpha * float(self.m ** 2) / math.fsum(c * _inverse_powers[r] for r, c in enumerate(self.hist) if c)
         return (E - estimate_bias(E, self.p)) if E <= 5 * self.m else E
 
     def card(self):
         """
         Returns the estimate of the cardinality
+
+        The estimate only depends on the register histogram and is cached until the counter changes.
         """
 
+        if self._card is None:
+            self._card = self._estimate()
+        return self._card
+
+    def _estimate(self):
+        if self.M is None:
+            # linear counting over the 2 ** SPARSE_P sparse registers
+            self._merge_sparse()
+        if self.M is None:
+            return sparse_estimate(len(self.S))
+
         #count number or registers equal to 0
-        V = self.M.count(0)
+        V = self.hist[0]
 
         if V > 0:
             H = self.m * math.log(self.m / float(V))
@@ -158,7 +572,103 @@ class HyperLogLog(object):
         '''
         Serializes hll object as dictionary using compressed bytes string
         '''
-        return base64.b64encode( zlib.compress( pickle.dumps( dict([x, getattr(self, x)] for x in self.__slots__) ) ) ).decode('utf-8')
+        return base64.b64encode( zlib.compress( pickle.dumps( self.__getstate__() ) ) ).decode('utf-8')
+
+    def to_bytes(self, packed=False, compress=False):
+        '''
+        Serializes hll object to the versioned binary format described at BINARY_MAGIC
+
+        Unpacked, uncompressed output can be loaded without copying the registers by from_buffer.
+        '''
+        if self.M is None:
+            self._merge_sparse()
+        flags = (FLAG_PACKED if packed else 0) | (FLAG_COMPRESSED if compress else 0)
+        if self.M is None:
+            flags |= FLAG_SPARSE
+            registers = self.S.astype('<u4').tobytes()
+        else:
+            registers = pack_registers(self.M) if packed else bytes(self.M)
+        k = self.k.sorted()
+        minhash = np.diff(k, prepend=np.uint64(0)).astype('<u8').tobytes()
+        payload = registers + minhash
+        if compress:
+            payload = zlib.compress(payload)
+        header = binary_header.pack(BINARY_MAGIC, BINARY_VERSION, flags, self.p, self.error_rate,
+                                    self.k_len, len(k), len(self.S) if self.M is None else 0)
+        return header + payload
+
+    @classmethod
+    def from_bytes(cls, data, allow_pickle=False):
+        '''
+        Loads a hll object from to_bytes output, see from_buffer
+        '''
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        return cls.from_buffer(data, copy=True, allow_pickle=allow_pickle)
+
+    @classmethod
+    def from_buffer(cls, buffer, copy=False, allow_pickle=False):
+        '''
+        Loads a hll object from a buffer holding to_bytes output
+
+        Unless copy is True, the registers of unpacked, uncompressed dense counters wrap the
+        buffer instead of being copied; they are copied on the first change. Older serialize
+        strings are only accepted, for migration, with allow_pickle=True: they are pickles and
+        must only be loaded from trusted sources. Anything else raises ValueError.
+        '''
+        view = memoryview(buffer).cast('B')
+        if bytes(view[:4]) != BINARY_MAGIC:
+            if not allow_pickle:
+                raise ValueError('Not a drac binary sketch; older serialize strings need allow_pickle=True')
+            hll = cls.__new__(cls)
+            hll.__setstate__(cls.deserialize(bytes(view)))
+            return hll
+
+        if len(view) < binary_header.size:
+            raise ValueError('Truncated binary sketch: %d bytes is shorter than the header' % len(view))
+        magic, version, flags, p, error_rate, k_len, n, s = binary_header.unpack_from(view)
+        if version != BINARY_VERSION:
+            raise ValueError('Unsupported binary format version %d' % version)
+        if n > k_len:
+            raise ValueError('Binary sketch holds %d minhash values, more than its minhash_counter_len %d' % (n, k_len))
+        payload = view[binary_header.size:]
+        if flags & FLAG_COMPRESSED:
+            try:
+                payload = memoryview(zlib.decompress(payload))
+            except zlib.error as e:
+                raise ValueError('Corrupt compressed binary sketch: %s' % e)
+        if flags & FLAG_SPARSE:
+            size = 4 * s
+        elif flags & FLAG_PACKED:
+            size = 3 * (1 << p) // 4
+        else:
+            size = 1 << p
+        if len(payload) != size + 8 * n:
+            raise ValueError('Binary sketch payload is %d bytes, expected %d for its %s registers and %d minhash values' % (
+                len(payload), size + 8 * n, 'sparse' if flags & FLAG_SPARSE else 'dense', n))
+
+        hll = cls.__new__(cls)
+        hll.alpha = get_alpha(p)
+        hll.p = p
+        hll.m = 1 << p
+        hll.error_rate = error_rate
+        hll.k_len = k_len
+        hll.tmp = []
+        if flags & FLAG_SPARSE:
+            hll.M = None
+            hll.S = np.frombuffer(payload[:size], dtype='<u4').astype(np.uint32)
+        elif flags & FLAG_PACKED:
+            hll.M = unpack_registers(payload[:size])
+            hll.S = None
+        else:
+            hll.M = bytearray(payload[:size]) if copy else payload[:size].toreadonly()
+            hll.S = None
+        hll._count_registers()
+
+        hll.k = BottomK(k_len)
+        hll.k.values = np.cumsum(np.frombuffer(payload[size:size + 8 * n], dtype='<u8'), dtype=np.uint64)
+        hll.k._set_threshold()
+        return hll
 
     def setstate_from_serialization( self, x ):
         '''
@@ -171,15 +681,18 @@ class HyperLogLog(object):
         '''
         Get back the dictionary saved by the serialize method
         '''
-        return pickle.loads( zlib.decompress( base64.b64decode( x ) ) )
+        return LegacyUnpickler( io.BytesIO( zlib.decompress( base64.b64decode( x ) ) ) ).load()
 
     @staticmethod
     def jaccard(ks):
         '''
         Gets jaccard index of several minhash counters
         '''
-        ks = [set(i) for i in ks]
-        return len( set.intersection(*ks) ) / len( set.union(*ks) )
+        ks = [np.unique(np.asarray(i, dtype=np.uint64)) for i in ks]
+        intersection = ks[0]
+        for i in ks[1:]:
+            intersection = np.intersect1d(intersection, i, assume_unique=True)
+        return len( intersection ) / len( np.unique(np.concatenate(ks)) )
 
     @staticmethod
     def get_min_card(x):
@@ -202,7 +715,7 @@ class HyperLogLog(object):
         '''
         max_card = HyperLogLog.get_max_card( x )
         k_len = x[0].k_len
-        return [ [i for i in hll.k if i<2**64][ 0:int( k_len * hll.card() / max_card ) ] for hll in x  ]
+        return [ hll.k.sorted()[ 0:int( k_len * hll.card() / max_card ) ] for hll in x  ]
 
     @staticmethod
     def get_corrected_jaccard(x):
@@ -220,6 +733,24 @@ class HyperLogLog(object):
         [hll_temp.update(hll) for hll in x]
         return int( HyperLogLog.get_corrected_jaccard( x ) * hll_temp.card() )
 
+    @staticmethod
+    def pairwise_jaccard(x, processes=None):
+        '''
+        Returns the N x N matrix of get_corrected_jaccard for every pair of hlls in x
+
+        Cardinalities and sorted minhash arrays are computed once and shared by all pairs.
+        With processes set, rows are spread over a process pool. Undefined entries
+        (empty hlls) are nan.
+        '''
+        return pairwise_matrix(x, False, processes)
+
+    @staticmethod
+    def pairwise_intersection(x, processes=None):
+        '''
+        Returns the N x N matrix of get_intersection_card for every pair of hlls in x, see pairwise_jaccard
+        '''
+        return pairwise_matrix(x, True, processes)
+
     @staticmethod
     def containment(x):
         '''
@@ -228,3 +759,80 @@ class HyperLogLog(object):
         '''
         int_card = HyperLogLog.get_intersection_card(x)
         return [int_card / len(i) for i in x]
+
+
+def pairwise_state(x, intersection):
+    '''
+    Precomputes what every pair of pairwise_matrix needs from the hlls in x
+    '''
+    return {
+        'hlls': x if intersection else None,
+        'ks': [hll.k.sorted() for hll in x],
+        'cards': [hll.card() for hll in x],
+        'k_lens': [hll.k_len for hll in x],
+        'intersection': intersection,
+    }
+
+def pairwise_row(state, i):
+    '''
+    Computes row i of pairwise_matrix; only the upper triangle when the matrix is symmetric
+    '''
+    ks, cards, k_lens = state['ks'], state['cards'], state['k_lens']
+    if len(set(k_lens)) == 1:
+        columns = range(i + 1, len(ks))
+    else:
+        columns = [j for j in range(len(ks)) if j != i]
+    row = []
+    for j in columns:
+        max_card = max(cards[i], cards[j])
+        if max_card == 0:
+            row.append((j, math.nan))
+            continue
+        # same truncation as get_corrected_ks, with k_len of the first hll of the pair
+        a = ks[i][ 0:int( k_lens[i] * cards[i] / max_card ) ]
+        b = ks[j][ 0:int( k_lens[i] * cards[j] / max_card ) ]
+        if len(b):
+            common = int(np.count_nonzero(b[np.searchsorted(b, a).clip(0, len(b) - 1)] == a))
+        else:
+            common = 0
+        union = len(a) + len(b) - common
+        value = common / union if union else math.nan
+        if state['intersection'] and union:
+            hlls = state['hlls']
+            value = int( value * HyperLogLog._union_registers([hlls[i], hlls[j]]).card() )
+        row.append((j, value))
+    return i, row
+
+_pool_state = None
+
+def _init_pool_state(data, intersection):
+    global _pool_state
+    _pool_state = pairwise_state([HyperLogLog.from_bytes(i) for i in data], intersection)
+
+def _pool_row(i):
+    return pairwise_row(_pool_state, i)
+
+def pairwise_matrix(x, intersection, processes=None):
+    '''
+    Returns the matrix of pairwise corrected jaccard indices, or intersection cardinalities, of x
+    '''
+    n = len(x)
+    state = pairwise_state(x, intersection)
+    result = np.full((n, n), math.nan)
+    for i, card in enumerate(state['cards']):
+        if card > 0:
+            result[i, i] = int( HyperLogLog._union_registers([x[i]]).card() ) if intersection else 1.0
+    symmetric = len(set(state['k_lens'])) == 1
+    if processes:
+        # workers rebuild the hlls from the binary format instead of unpickling them
+        data = [hll.to_bytes() for hll in x]
+        with multiprocessing.Pool(processes, _init_pool_state, (data, intersection)) as pool:
+            rows = list(pool.imap_unordered(_pool_row, range(n)))
+    else:
+        rows = [pairwise_row(state, i) for i in range(n)]
+    for i, row in rows:
+        for j, value in row:
+            result[i, j] = value
+            if symmetric:
+                result[j, i] = value
+    return result
@@ -0,0 +1,121 @@
+"""
+This module implements the bounded bottom-k minhash counter used by HyperLogLog for intersections
+"""
+
+import numpy as np
+
+
+def merge_sorted(arrays, k, batch=64):
+    '''
+    Merges sorted uint64 arrays into the sorted array of their k smallest distinct values
+
+    Arrays are merged a batch at a time and each one is cut at the current k-th smallest
+    value first, so at most batch + 1 bounded arrays are held at once.
+    '''
+    merged = np.empty(0, dtype=np.uint64)
+    for start in range(0, len(arrays), batch):
+        chunk = [merged]
+        for i in arrays[start:start + batch]:
+            i = np.asarray(i, dtype=np.uint64)[:k]
+            if len(merged) == k:
+                i = i[:np.searchsorted(i, merged[-1])]
+            chunk.append(i)
+        merged = np.unique(np.concatenate(chunk))[:k]
+    return merged
+
+
+class BottomK(object):
+    """
+    Keeps the k smallest distinct uint64 hashes seen so far
+    """
+
+    __slots__ = ('k', 'values', 'pending', 'threshold')
+
+    def __init__(self, k, values=()):
+        """
+        Creates an empty bottom-k counter, optionally filled with values
+
+        Nothing is allocated up front: values are collected lazily, and once k of them
+        are held, hashes at or above the current k-th smallest are rejected with a
+        single comparison.
+        """
+        self.k = k
+        self.values = np.empty(0, dtype=np.uint64) # sorted, distinct, at most k hashes
+        self.pending = [] # accepted single hashes not yet merged into values
+        self.threshold = 2**64 # hashes >= threshold can not enter values
+        if len(values):
+            self.update(values)
+
+    def __getstate__(self):
+        return {'k': self.k, 'values': self.sorted().tobytes()}
+
+    def __setstate__(self, d):
+        self.k = d['k']
+        self.values = np.frombuffer(d['values'], dtype=np.uint64).copy()
+        self.pending = []
+        self._set_threshold()
+
+    @classmethod
+    def union(cls, counters, k):
+        """
+        Returns a new counter holding the k smallest hashes of all counters
+        """
+        new = cls(k)
+        new.values = merge_sorted([i.sorted() for i in counters], k)
+        new._set_threshold()
+        return new
+
+    def _set_threshold(self):
+        if len(self.values) < self.k:
+            self.threshold = 2**64
+        else:
+            # a counter of k = 0 is always full and rejects every hash
+            self.threshold = int(self.values[-1]) if self.k else 0
+
+    def add(self, x):
+        """
+        Adds a single hash
+        """
+        if x < self.threshold:
+            self.pending.append(x)
+            if 4 * len(self.pending) > self.k:
+                self._merge()
+
+    def update(self, *arrays):
+        """
+        Adds arrays (or iterables) of hashes in one batch
+        """
+        arrays = [np.asarray(i, dtype=np.uint64) for i in arrays]
+        if self.threshold < 2**64:
+            arrays = [i[i < np.uint64(self.threshold)] for i in arrays]
+        arrays = [i for i in arrays if len(i)]
+        if arrays or self.pending:
+            self._merge(*arrays)
+
+    def _merge(self, *arrays):
+        self.values = np.unique(np.concatenate((self.values, np.array(self.pending, dtype=np.uint64)) + arrays))[:self.k]
+        self.pending = []
+        self._set_threshold()
+
+    def sorted(self):
+        """
+        Returns the sorted uint64 array of the bottom-k hashes
+        """
+        if self.pending:
+            self._merge()
+        return self.values
+
+    def __len__(self):
+        return len(self.sorted())
+
+    def __iter__(self):
+        return iter(self.sorted().tolist())
+
+    def __getitem__(self, i):
+        return self.sorted().tolist()[i] if isinstance(i, slice) else int(self.sorted()[i])
+
+    def __eq__(self, other):
+        return self.k == other.k and np.array_equal(self.sorted(), other.sorted())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
@@ -0,0 +1,97 @@
+"""
+This module builds a HyperLogLog over a process pool by sharding the input and merging the shard sketches
+"""
+
+import gzip
+import multiprocessing
+import os
+import threading
+from .hll import HyperLogLog, iter_batches
+
+
+def iter_file_shards(paths, shard_size):
+    '''
+    Splits files into (path, start, end) byte ranges of about shard_size bytes
+
+    Gzip files can not be split and are always a single shard.
+    '''
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= shard_size:
+            yield path, 0, None
+        else:
+            for start in range(0, size, shard_size):
+                yield path, start, start + shard_size
+
+def iter_shard_lines(path, start, end):
+    '''
+    Yields the non-empty lines, as bytes without the line ending, that start within [start, end)
+    '''
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if start:
+            # skip the line that started in the previous shard
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            line = line.rstrip(b'\r\n')
+            if line:
+                yield line
+
+def build_shard(args):
+    '''
+    Builds the sketch of one shard in a worker and returns it in the binary format
+    '''
+    shard, files, error_rate, minhash_counter_len, batch_size = args
+    hll = HyperLogLog(error_rate, minhash_counter_len)
+    values = iter_shard_lines(*shard) if files else shard
+    hll.add_many(values, batch_size)
+    return hll.to_bytes()
+
+def build_parallel(source, workers=None, error_rate=0.01, minhash_counter_len=2**16, files=False,
+                   chunk_size=2**18, shard_size=2**26, batch_size=2**16):
+    '''
+    Builds a HyperLogLog of all values of source using a pool of worker processes
+
+    source is an iterable of values, sent to the workers in chunks of chunk_size values, or
+    with files=True a list of paths of newline delimited values (optionally gzipped) that
+    the workers read themselves in byte ranges of shard_size. Every worker builds a local
+    sketch with add_many and ships it back in the binary format; the shard sketches are
+    merged into the result as they arrive. The result is the same as adding every value to
+    one sketch.
+    '''
+    if files:
+        shards = iter_file_shards([source] if isinstance(source, str) else source, shard_size)
+    else:
+        shards = iter_batches(source, chunk_size)
+
+    workers = workers or os.cpu_count()
+    # a pool reads all of its tasks up front, so only let a few per worker be in flight to keep
+    # the pending chunks and the shard sketches in memory bounded; a slot frees up as soon as
+    # any result has been merged, so workers never wait for the slowest shard of a batch
+    slots = threading.Semaphore(4 * workers)
+    stopped = []
+
+    def tasks():
+        for shard in shards:
+            slots.acquire()
+            if stopped:
+                return
+            yield shard, files, error_rate, minhash_counter_len, batch_size
+
+    hll = HyperLogLog(error_rate, minhash_counter_len)
+    with multiprocessing.Pool(workers) as pool:
+        try:
+            for result in pool.imap_unordered(build_shard, tasks()):
+                hll.update(HyperLogLog.from_bytes(result))
+                slots.release()
+        finally:
+            # unblock the task feeding thread if we stop early
+            stopped.append(True)
+            for _ in range(4 * workers):
+                slots.release()
+    return hll
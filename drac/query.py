@@ -0,0 +1,215 @@
+"""
+This module evaluates the cardinality of set expressions like (A & B) | C or A - B over named HyperLogLog objects
+"""
+
+import collections
+import itertools
+import math
+import re
+import numpy as np
+from .hll import HyperLogLog
+
+QueryResult = collections.namedtuple('QueryResult', ['estimate', 'error'])
+
+# names are bare words or quoted strings; '∩' and '∪' are accepted for '&' and '|'
+_token = re.compile(r'\s*(?:(?P<op>[&|\-()∩∪])|"(?P<quoted>[^"]*)"|(?P<name>[\w.:/]+))')
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _token.match(expression, pos)
+        if not match:
+            raise ValueError('Invalid expression at %r' % expression[pos:])
+        op, quoted, name = match.group('op', 'quoted', 'name')
+        if op:
+            tokens.append({'∩': '&', '∪': '|'}.get(op, op))
+        else:
+            tokens.append(('name', name if quoted is None else quoted))
+        pos = match.end()
+    return tokens
+
+def parse(expression):
+    '''
+    Parses a set expression into nested ('name', name) and (op, left, right) tuples
+
+    Operators bind like Python set operators: '-' before '&' before '|', all left associative.
+    '''
+    tokens = tokenize(expression)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take():
+        token = peek()
+        pos[0] += 1
+        return token
+
+    def atom():
+        token = take()
+        if token == '(':
+            node = level(0)
+            if take() != ')':
+                raise ValueError('Missing ) in %r' % expression)
+            return node
+        if isinstance(token, tuple):
+            return token
+        raise ValueError('Expected a name or ( in %r' % expression)
+
+    levels = ['|', '&', '-']
+
+    def level(i):
+        if i == len(levels):
+            return atom()
+        node = level(i + 1)
+        while peek() == levels[i]:
+            take()
+            node = (levels[i], node, level(i + 1))
+        return node
+
+    node = level(0)
+    if peek() is not None:
+        raise ValueError('Unexpected %r in %r' % (peek(), expression))
+    return node
+
+def union_names(node):
+    '''
+    Returns the frozenset of names of a node made only of unions, or None
+    '''
+    if node[0] == 'name':
+        return frozenset([node[1]])
+    if node[0] == '|':
+        left, right = union_names(node[1]), union_names(node[2])
+        if left is not None and right is not None:
+            return left | right
+    return None
+
+
+class QueryEngine(object):
+    """
+    Estimates cardinalities of set expressions over named HyperLogLog objects, memoizing shared sub-terms
+    """
+
+    def __init__(self, sketches=None, max_terms=12):
+        """
+        Creates an engine over a dict of name -> HyperLogLog
+
+        Maximal sub-expressions made only of unions (single names included) become terms
+        backed by a union sketch. An expression over n terms is split into the Venn regions
+        of its terms, which inclusion-exclusion turns into a signed sum of intersection
+        cardinalities; those are estimated as in get_intersection_card, from the corrected
+        minhash Jaccard index and the cardinality of the union. Union sketches and
+        intersection cardinalities are cached by the sets of names they cover, so queries
+        sharing sub-terms reuse them. The cache assumes unchanged sketches: assigning a
+        sketch through the engine clears it, other changes need clear().
+        """
+        self.sketches = dict(sketches or {})
+        self.max_terms = max_terms
+        self.clear()
+
+    def clear(self):
+        self.unions = {} # frozenset of names -> union HyperLogLog
+        self.intersections = {} # frozenset of terms -> QueryResult of their intersection
+        self.results = {} # parsed expression -> QueryResult
+
+    def __setitem__(self, name, hll):
+        self.sketches[name] = hll
+        self.clear()
+
+    def __getitem__(self, name):
+        return self.sketches[name]
+
+    def union(self, names):
+        """
+        Returns the (cached) union sketch of names, which must not be changed
+        """
+        names = frozenset(names)
+        if names not in self.unions:
+            missing = [name for name in names if name not in self.sketches]
+            if missing:
+                raise KeyError(missing[0])
+            sketches = [self.sketches[name] for name in sorted(names)]
+            self.unions[names] = sketches[0] if len(sketches) == 1 else HyperLogLog.union_many(sketches)
+        return self.unions[names]
+
+    def _intersection(self, terms):
+        """
+        Estimates the cardinality of the intersection of terms, each a frozenset of names
+        """
+        if terms not in self.intersections:
+            union = self.union(frozenset().union(*terms))
+            card = union.card()
+            if not card:
+                # every term is empty, and get_corrected_ks would divide by zero
+                self.intersections[terms] = QueryResult(0.0, 0.0)
+                return self.intersections[terms]
+            # relative standard error of the HLL estimate
+            error = 1.04 / math.sqrt(union.m)
+            if len(terms) > 1:
+                hlls = [self.union(term) for term in sorted(terms, key=sorted)]
+                ks = HyperLogLog.get_corrected_ks(hlls)
+                sample = len(np.unique(np.concatenate(ks)))
+                jaccard = HyperLogLog.jaccard(ks)
+                card *= jaccard
+                # binomial error of the Jaccard index over the minhash values of the union
+                if jaccard:
+                    error = math.sqrt(error ** 2 + (1 - jaccard) / (jaccard * sample))
+            self.intersections[terms] = QueryResult(card, card * error)
+        return self.intersections[terms]
+
+    def evaluate(self, expression):
+        """
+        Returns a QueryResult with the estimated cardinality of expression and its standard error
+        """
+        node = parse(expression) if isinstance(expression, str) else expression
+        if node not in self.results:
+            self.results[node] = self._evaluate(node)
+        return self.results[node]
+
+    def _evaluate(self, node):
+        names = union_names(node)
+        if names is not None:
+            return self._intersection(frozenset([names]))
+
+        terms = []
+        def collect(node):
+            names = union_names(node)
+            if names is not None:
+                if names not in terms:
+                    terms.append(names)
+            else:
+                collect(node[1])
+                collect(node[2])
+        collect(node)
+        if len(terms) > self.max_terms:
+            raise ValueError('Too many terms (%d) in the expression' % len(terms))
+
+        def contains(node, inside):
+            names = union_names(node)
+            if names is not None:
+                return names in inside
+            left, right = contains(node[1], inside), contains(node[2], inside)
+            return {'|': left or right, '&': left and right, '-': left and not right}[node[0]]
+
+        # every Venn region inside the terms I and outside the others O contributes
+        # |I \ (union of O)| = sum over T subset of O of (-1) ** |T| * |intersection of I + T|
+        coefficients = collections.defaultdict(int)
+        for n in range(1, len(terms) + 1):
+            for inside in itertools.combinations(terms, n):
+                if not contains(node, set(inside)):
+                    continue
+                outside = [term for term in terms if term not in inside]
+                for m in range(len(outside) + 1):
+                    for extra in itertools.combinations(outside, m):
+                        coefficients[frozenset(inside + extra)] += (-1) ** m
+
+        estimate = 0.0
+        variance = 0.0
+        for subset, coefficient in coefficients.items():
+            if coefficient:
+                result = self._intersection(subset)
+                estimate += coefficient * result.estimate
+                variance += (coefficient * result.error) ** 2
+        return QueryResult(max(estimate, 0.0), math.sqrt(variance))
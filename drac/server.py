@@ -0,0 +1,336 @@
+"""
+This module implements an asyncio sketch server holding named HyperLogLog objects, and its client
+
+The protocol is newline delimited JSON over TCP. Every request is an object with an "id" and an
+"op" ("add", "card", "jaccard", "intersection", "names", "stats" or "snapshot") plus its arguments;
+the response repeats the id with either a "result" or an "error". Requests on one connection can
+be pipelined and are answered as they complete.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import time
+from .hll import HyperLogLog
+from .store import SketchStore
+
+logger = logging.getLogger(__name__)
+
+class RequestError(Exception):
+    """
+    Error returned by the sketch server for a request
+    """
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(math.ceil(q / 100.0 * len(sorted_values))) - 1)]
+
+
+class SketchServer(object):
+    """
+    Long running holder of named sketches with batched writes and coalesced queries
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, snapshot_path=None, snapshot_interval=60.0,
+                 flush_interval=0.05, batch_size=2**14, error_rate=0.01, minhash_counter_len=2**16):
+        """
+        Creates a server, loading the sketches of snapshot_path if it exists
+
+        Added values are buffered per sketch and applied with add_many every flush_interval
+        seconds, or as soon as batch_size values are pending; queries first apply the pending
+        values of the sketches they read. All sketch work runs in order on one worker thread,
+        keeping the event loop free, and identical queries arriving while one is queued or
+        running share its result unless the sketches they read were added to since. Every
+        snapshot_interval seconds the sketches are written to snapshot_path as a SketchStore.
+        """
+        self.host = host
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.error_rate = error_rate
+        self.k_len = minhash_counter_len
+        self.sketches = {}
+        self.pending = collections.defaultdict(list) # name -> values not yet added
+        self.inflight = {} # (op, names) -> future of the running query
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=10000)) # op -> seconds
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.server = None
+        self.tasks = []
+        if snapshot_path and os.path.exists(snapshot_path):
+            with SketchStore(snapshot_path, readonly=True) as store:
+                self.sketches = dict((key, HyperLogLog.from_bytes(hll.to_bytes())) for key, hll in store.items())
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=2**26)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.tasks = [asyncio.ensure_future(self.flush_periodically())]
+        if self.snapshot_path:
+            self.tasks.append(asyncio.ensure_future(self.snapshot_periodically()))
+
+    async def stop(self):
+        """
+        Stops serving, applies the pending values and writes a last snapshot
+        """
+        for task in self.tasks:
+            task.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        try:
+            await self.run_pending(self._apply)
+        except Exception:
+            logger.exception('Applying the pending values failed')
+        if self.snapshot_path:
+            await self.run_pending(self._snapshot)
+        self.executor.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    def take_pending(self, names=None):
+        """
+        Removes and returns the pending values of names (default all) as a dict, on the event loop
+        """
+        names = list(self.pending) if names is None else names
+        return dict((name, self.pending.pop(name)) for name in names if name in self.pending)
+
+    def restore_pending(self, batches):
+        """
+        Puts back the values of batches that were not applied, on the event loop
+        """
+        for name, values in batches.items():
+            self.pending[name][:0] = values
+
+    def run_pending(self, function, names=None, *args):
+        """
+        Runs function(*args, batches) on the worker thread with the pending values of names
+
+        function removes the batches it applied; whatever is left is pending again when it
+        is done, so values are only dropped once they are in a sketch.
+        """
+        batches = self.take_pending(names)
+        future = self.run(function, *(args + (batches,)))
+        future.add_done_callback(lambda f: self.restore_pending(batches))
+        return future
+
+    def _apply(self, batches):
+        for name in list(batches):
+            hll = self.sketches.get(name)
+            if hll is None:
+                hll = HyperLogLog(self.error_rate, self.k_len)
+            hll.add_many(batches[name])
+            self.sketches[name] = hll
+            del batches[name]
+
+    def _snapshot(self, batches):
+        try:
+            self._apply(batches)
+        except Exception:
+            logger.exception('Applying the pending values failed, snapshotting without them')
+        tmp_path = self.snapshot_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with SketchStore(tmp_path) as store:
+            store.append_many(list(self.sketches.items()))
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.pending:
+                try:
+                    await self.run_pending(self._apply)
+                except Exception:
+                    logger.exception('Applying the pending values failed')
+
+    async def snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.run_pending(self._snapshot)
+            except Exception:
+                logger.exception('Snapshot to %s failed', self.snapshot_path)
+
+    def _query(self, op, names, batches):
+        self._apply(batches)
+        missing = [name for name in names if name not in self.sketches]
+        if missing:
+            raise KeyError(missing[0])
+        hlls = [self.sketches[name] for name in names]
+        if op == 'card':
+            return hlls[0].card()
+        if op == 'jaccard':
+            return HyperLogLog.get_corrected_jaccard(hlls)
+        return HyperLogLog.get_intersection_card(hlls)
+
+    async def query(self, op, names):
+        """
+        Runs a query, or joins the identical one already queued or running
+        """
+        key = (op, tuple(names))
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = self.run_pending(self._query, names, op, names)
+            def done(future):
+                if self.inflight.get(key) is future:
+                    del self.inflight[key]
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def handle(self, request):
+        op = request.get('op')
+        if op == 'add':
+            name, values = request.get('name'), request.get('values')
+            if not isinstance(name, str):
+                raise ValueError('name should be a string')
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError('values should be a list of strings')
+            self.pending[name].extend(values)
+            # later reads must not join a query that was started before this add
+            for key in [key for key in self.inflight if name in key[1]]:
+                del self.inflight[key]
+            if len(self.pending[name]) >= self.batch_size:
+                await self.run_pending(self._apply, [name])
+            return len(values)
+        if op == 'card':
+            return await self.query(op, [request['name']])
+        if op in ('jaccard', 'intersection'):
+            return await self.query(op, list(request['names']))
+        if op == 'names':
+            # the worker thread adds to self.sketches, so only it iterates the dict
+            names = await self.run(list, self.sketches)
+            return sorted(set(names) | set(self.pending))
+        if op == 'stats':
+            return self.stats()
+        if op == 'snapshot':
+            if not self.snapshot_path:
+                raise ValueError('Server has no snapshot path')
+            await self.run_pending(self._snapshot)
+            return True
+        raise ValueError('Unknown op %r' % op)
+
+    def stats(self):
+        """
+        Returns the request count and the 50th, 95th and 99th latency percentiles in ms per op
+        """
+        stats = {}
+        for op, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            stats[op] = {'count': len(latencies)}
+            for q in (50, 95, 99):
+                stats[op]['p%d' % q] = 1000 * percentile(latencies, q)
+        return stats
+
+    async def respond(self, request, writer):
+        start = time.perf_counter()
+        try:
+            response = {'id': request.get('id'), 'result': await self.handle(request)}
+        except Exception as e:
+            response = {'id': request.get('id'), 'error': '%s: %s' % (type(e).__name__, e)}
+        self.latencies[request.get('op')].append(time.perf_counter() - start)
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+
+    async def handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"id": null, "error": "ValueError: invalid JSON"}\n')
+                    continue
+                task = asyncio.ensure_future(self.respond(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class SketchClient(object):
+    """
+    Asyncio client of a SketchServer; requests may be issued concurrently
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {} # request id -> future of the response
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=0):
+        reader, writer = await asyncio.open_connection(host, port, limit=2**26)
+        return cls(reader, writer)
+
+    async def receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(RequestError(response['error']))
+                else:
+                    future.set_result(response['result'])
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection to the sketch server closed'))
+
+    async def request(self, op, **args):
+        self.next_id += 1
+        args.update(id=self.next_id, op=op)
+        future = self.waiting[self.next_id] = asyncio.get_event_loop().create_future()
+        self.writer.write(json.dumps(args).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def add(self, name, values):
+        return await self.request('add', name=name, values=list(values))
+
+    async def card(self, name):
+        return await self.request('card', name=name)
+
+    async def jaccard(self, names):
+        return await self.request('jaccard', names=list(names))
+
+    async def intersection(self, names):
+        return await self.request('intersection', names=list(names))
+
+    async def names(self):
+        return await self.request('names')
+
+    async def stats(self):
+        return await self.request('stats')
+
+    async def snapshot(self):
+        return await self.request('snapshot')
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
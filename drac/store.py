@@ -0,0 +1,192 @@
+"""
+This module implements a single file store of many keyed HyperLogLog objects, read through mmap
+"""
+
+import mmap
+import os
+import struct
+from .hll import HyperLogLog
+
+# File layout (little endian): a 16 byte header, b'DRACSTOR' and the uint32 version followed
+# by 4 reserved bytes, then appended records. Every record is a record_header (key length,
+# flags, data length), the utf-8 key and the HyperLogLog.to_bytes data. A later record for
+# the same key replaces the earlier one, and a record with FLAG_DELETED removes the key.
+STORE_MAGIC = b'DRACSTOR'
+STORE_VERSION = 1
+FLAG_DELETED = 1
+store_header = struct.Struct('<8sI4x')
+record_header = struct.Struct('<IIQ')
+
+
+class SketchStore(object):
+    """
+    Keyed HyperLogLog store backed by one append-only file
+    """
+
+    def __init__(self, path, readonly=False):
+        """
+        Opens the store at path, creating it unless readonly is True
+
+        Only the record headers are read to build the key index; store[key] returns a
+        HyperLogLog whose registers wrap the memory mapped file, so only the pages of the
+        sketches actually used are loaded. An incomplete record at the end of the file, left
+        by a crash during a write, is ignored, and cut off when the store is opened for writing.
+        """
+        self.path = path
+        self.readonly = readonly
+        if not os.path.exists(path):
+            if readonly:
+                raise IOError('No sketch store at %s' % path)
+            with open(path, 'wb') as f:
+                f.write(store_header.pack(STORE_MAGIC, STORE_VERSION))
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'rb' if self.readonly else 'r+b')
+        self._map = None
+        self.index = {} # key -> (offset, length) of the latest data of every live key
+        if os.fstat(self._file.fileno()).st_size < store_header.size:
+            if self.readonly:
+                self.close()
+                raise ValueError('%s is not a sketch store' % self.path)
+            # a crash right after creating the file
+            self._file.truncate(0)
+            self._file.write(store_header.pack(STORE_MAGIC, STORE_VERSION))
+            self._file.flush()
+        self._remap()
+        magic, version = store_header.unpack_from(self._map)
+        if magic != STORE_MAGIC:
+            self.close()
+            raise ValueError('%s is not a sketch store' % self.path)
+        if version != STORE_VERSION:
+            self.close()
+            raise ValueError('Unsupported sketch store version %d' % version)
+        self._scan(store_header.size)
+        if self._end < self._size and not self.readonly:
+            # cut off the incomplete last record so appends follow the last complete one
+            self._map.close()
+            self._file.truncate(self._end)
+            self._remap()
+
+    def _remap(self):
+        """
+        Maps the whole file again after it grew
+        """
+        # sketches loaded earlier keep the previous map alive through their registers
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._size = len(self._map)
+
+    def _scan(self, offset):
+        """
+        Adds the complete records from offset to the end of the file to the index
+
+        Sets self._end to the end of the last complete record.
+        """
+        while offset + record_header.size <= self._size:
+            key_len, flags, data_len = record_header.unpack_from(self._map, offset)
+            start = offset + record_header.size
+            if start + key_len + data_len > self._size:
+                break
+            key = self._map[start:start + key_len].decode('utf-8')
+            if flags & FLAG_DELETED:
+                self.index.pop(key, None)
+            else:
+                self.index[key] = (start + key_len, data_len)
+            offset = start + key_len + data_len
+        self._end = offset
+
+    def _append(self, records):
+        """
+        Writes (key, flags, data) records at the end of the file in one write
+        """
+        if self.readonly:
+            raise IOError('Sketch store is read only')
+        chunks = []
+        for key, flags, data in records:
+            key = key.encode('utf-8')
+            chunks += [record_header.pack(len(key), flags, len(data)), key, data]
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+        offset = self._end
+        self._remap()
+        self._scan(offset)
+
+    def __getitem__(self, key):
+        offset, length = self.index[key]
+        return HyperLogLog.from_buffer(memoryview(self._map)[offset:offset + length])
+
+    def __setitem__(self, key, hll):
+        self._append([(key, 0, hll.to_bytes())])
+
+    def __delitem__(self, key):
+        if key not in self.index:
+            raise KeyError(key)
+        self._append([(key, FLAG_DELETED, b'')])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        for key in self.index:
+            yield key, self[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self.index else default
+
+    def append_many(self, items):
+        """
+        Appends many (key, hll) pairs, or a dict of them, with a single write
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        self._append([(key, 0, hll.to_bytes()) for key, hll in items])
+
+    def garbage(self):
+        """
+        Returns the number of bytes taken by replaced and deleted records
+        """
+        live = sum(record_header.size + len(key.encode('utf-8')) + length for key, (offset, length) in self.index.items())
+        return self._end - store_header.size - live
+
+    def compact(self):
+        """
+        Rewrites the file with only the latest record of every live key
+        """
+        if self.readonly:
+            raise IOError('Sketch store is read only')
+        tmp_path = self.path + '.compact'
+        with open(tmp_path, 'wb') as f:
+            f.write(store_header.pack(STORE_MAGIC, STORE_VERSION))
+            for key, (offset, length) in self.index.items():
+                key = key.encode('utf-8')
+                f.write(record_header.pack(len(key), 0, length))
+                f.write(key)
+                f.write(self._map[offset:offset + length])
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._open()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass # still used by loaded sketches, released with them
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.benchmark import OPERATIONS, build, compare, error_rate, run_benchmarks
+from drac.hll import HyperLogLog
+
+
+class BenchmarkTestCase(TestCase):
+    def test_error_rate(self):
+        for p in range(4, 17):
+            self.assertEqual(HyperLogLog(error_rate(p)).p, p)
+
+    def test_build(self):
+        hll = build(10, 256, 0, 5000, chunk_size=1000)
+        self.assertAlmostEqual(hll.card(), 5000, delta=500)
+        self.assertEqual(hll, build(10, 256, 0, 5000))
+
+    def test_run_and_compare(self):
+        results = run_benchmarks([6], [64], [10, 1000], repeat=1, min_time=0)
+        # construct runs once per precision and minhash length
+        self.assertEqual(len(results), 2 * len(OPERATIONS) - 1)
+        for result in results:
+            self.assertGreater(result['seconds'], 0)
+            self.assertGreater(result['items_per_sec'], 0)
+            self.assertGreaterEqual(result['peak_bytes'], 0)
+
+        self.assertEqual(compare(results, results), [])
+        slower = [dict(result, seconds=2 * result['seconds']) for result in results if result['op'] == 'card']
+        regressions = compare(slower, results, threshold=0.5)
+        self.assertEqual([(r['op'], r['n'], r['metric']) for r in regressions], [('card', 10, 'seconds'), ('card', 1000, 'seconds')])
+        self.assertEqual(compare(slower, results, threshold=1.5), [])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.cli import main
+from drac.hll import HyperLogLog
+from drac.store import SketchStore
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+
+class CommandLineTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.csv = os.path.join(self.dir, 'rides.csv.gz')
+        with gzip.open(self.csv, 'wt') as f:
+            f.write('station,rider\n')
+            for i in range(3000):
+                f.write('s%d,"r%d"\n' % (i % 3, i % 1000))
+        self.lines = os.path.join(self.dir, 'riders.txt')
+        with open(self.lines, 'w') as f:
+            f.write('\n'.join('r%d' % i for i in range(500, 1500)) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def run_main(self, *argv):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            main(list(argv))
+        return out.getvalue()
+
+    def expected(self, values):
+        hll = HyperLogLog(0.05, 256)
+        hll.add_many(values)
+        return hll
+
+    def test_ingest_lines(self):
+        self.run_main('ingest', self.lines, '-o', self.path('out.drac'), '-e', '0.05', '-m', '256', '--chunk-bytes', '1000')
+        with SketchStore(self.path('out.drac')) as store:
+            self.assertEqual(list(store), ['all'])
+            self.assertEqual(store['all'], self.expected('r%d' % i for i in range(500, 1500)))
+            self.assertEqual(store['all'].k, self.expected('r%d' % i for i in range(500, 1500)).k)
+
+    def test_ingest_lines_header(self):
+        path = self.path('header.txt')
+        with open(path, 'w') as f:
+            f.write('rider\nr1\n\nr2\n')
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            main(['ingest', path, '--header', '-o', self.path('out.drac'), '-e', '0.05', '-m', '256'])
+        with SketchStore(self.path('out.drac')) as store:
+            self.assertEqual(store['all'], self.expected(['r1', 'r2']))
+        # the empty line is a row read, though not a value
+        self.assertTrue(err.getvalue().startswith('3 rows in'), err.getvalue())
+
+    def test_ingest_group_by(self):
+        self.run_main('ingest', self.csv, '-o', self.path('out.drac'), '-c', 'rider', '-g', 'station', '--header',
+                      '-e', '0.05', '-m', '256', '--chunk-rows', '100')
+        with SketchStore(self.path('out.drac')) as store:
+            self.assertEqual(sorted(store), ['s0', 's1', 's2'])
+            for s in range(3):
+                self.assertEqual(store['s%d' % s], self.expected('r%d' % (i % 1000) for i in range(s, 3000, 3)))
+        expected = round(self.expected('r%d' % (i % 1000) for i in range(0, 3000, 3)).card())
+        self.assertEqual(self.run_main('card', self.path('out.drac'), 's0'), 's0\t%d\n' % expected)
+
+    def test_ingest_multiline_fields(self):
+        # quoted values with embedded newlines, crossing chunk boundaries
+        path = self.path('notes.csv')
+        with open(path, 'w', newline='') as f:
+            f.write('key,note\n')
+            for i in range(500):
+                f.write('k%d,"line %d\nstill %d"\n' % (i % 2, i, i))
+        self.run_main('ingest', path, '-o', self.path('out.drac'), '-c', 'note', '-g', 'key', '--header',
+                      '-e', '0.05', '-m', '256', '--chunk-rows', '7')
+        with SketchStore(self.path('out.drac')) as store:
+            self.assertEqual(sorted(store), ['k0', 'k1'])
+            for k in range(2):
+                self.assertEqual(store['k%d' % k], self.expected('line %d\nstill %d' % (i, i) for i in range(k, 500, 2)))
+
+    def test_merge_and_jaccard(self):
+        self.run_main('ingest', self.csv, '-o', self.path('a.drac'), '-c', '1', '--header', '-k', 'rides', '-e', '0.05', '-m', '256')
+        self.run_main('ingest', self.lines, '-o', self.path('b.drac'), '-k', 'riders', '-e', '0.05', '-m', '256')
+        self.run_main('merge', self.path('a.drac'), self.path('b.drac'), '-o', self.path('c.drac'))
+        self.run_main('merge', self.path('a.drac'), self.path('b.drac'), '-o', self.path('c.drac'), '--into', 'both')
+        with SketchStore(self.path('c.drac')) as store:
+            self.assertEqual(sorted(store), ['both', 'riders', 'rides'])
+            self.assertEqual(store['both'], self.expected('r%d' % i for i in range(1500)))
+        output = self.run_main('jaccard', self.path('c.drac'), 'rides', 'riders').split('\n')
+        hlls = [self.expected('r%d' % i for i in range(1000)), self.expected('r%d' % i for i in range(500, 1500))]
+        self.assertEqual(output[0], 'jaccard\t%f' % HyperLogLog.get_corrected_jaccard(hlls))
+        self.assertEqual(output[1], 'intersection\t%d' % HyperLogLog.get_intersection_card(hlls))
+
+    def test_missing_key(self):
+        self.run_main('ingest', self.lines, '-o', self.path('out.drac'))
+        self.assertRaises(SystemExit, self.run_main, 'card', self.path('out.drac'), 'nope')
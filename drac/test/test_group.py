@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog, hash_values
+from drac.group import HyperLogLogGroup
+import numpy as np
+
+
+class HyperLogLogGroupTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # a few large groups and a long tail of small ones
+        self.keys = np.concatenate([rng.randint(0, 3, 30000), rng.randint(3, 200, 3000)])
+        self.values = rng.randint(0, 50000, len(self.keys))
+        self.expected = {}
+        for key, value in zip(self.keys.tolist(), self.values.tolist()):
+            if key not in self.expected:
+                self.expected[key] = HyperLogLog(0.05, minhash_counter_len=64)
+            self.expected[key].add(str(value))
+
+    def assertGroup(self, group, expected):
+        self.assertEqual(sorted(group), sorted(expected))
+        for key, hll in expected.items():
+            exported = group[key]
+            self.assertEqual(exported, hll)
+            self.assertEqual(exported.k, hll.k)
+            self.assertEqual(exported.is_sparse(), hll.is_sparse())
+            self.assertEqual(group.card(key), hll.card())
+
+    def test_add_many(self):
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        group.add_many(self.keys, self.values, batch_size=5000)
+        self.assertGroup(group, self.expected)
+        self.assertEqual(group.n_rows, 3)
+
+    def test_add(self):
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        for key, value in zip(self.keys[:2000].tolist(), self.values[:2000].tolist()):
+            group.add('station %d' % key, str(value))
+        expected = HyperLogLog(0.05, minhash_counter_len=64)
+        expected.add_many(np.unique(self.values[:2000][self.keys[:2000] == 1]))
+        self.assertEqual(group['station 1'], expected)
+        self.assertEqual(len(group['station 1']), len(expected))
+
+    def test_update(self):
+        a = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        b = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        half = len(self.keys) // 2
+        a.add_many(self.keys[:half], self.values[:half])
+        b.add_many(self.keys[half:], self.values[half:])
+        a.update(b)
+        self.assertGroup(a, self.expected)
+
+    def test_update_err(self):
+        self.assertRaises(ValueError, HyperLogLogGroup(0.05).update, HyperLogLogGroup(0.01))
+        self.assertRaises(ValueError, HyperLogLogGroup().add_many, [1, 2], [1])
+
+    def test_add_hashes(self):
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        group.add_hashes(self.keys, hash_values(self.values))
+        self.assertGroup(group, self.expected)
+
+    def test_many_keys(self):
+        rng = np.random.RandomState(1)
+        # a few keys turn dense, the others fill their minhash counters
+        keys = rng.permutation(np.concatenate([rng.randint(0, 5000, 60000), rng.randint(0, 3, 20000)]))
+        values = rng.randint(0, 10**6, len(keys))
+        group = HyperLogLogGroup(0.05, minhash_counter_len=8)
+        # small batches merge the buffered sparse entries and minhash values many times
+        group.add_many(keys[:50000], values[:50000], batch_size=1000)
+        other = HyperLogLogGroup(0.05, minhash_counter_len=8)
+        other.add_many(keys[50000:], values[50000:])
+        group.update(other)
+        self.assertEqual(group.n_rows, 3)
+        cards = group.cards()
+        for key in [0, 1, 2] + rng.choice(5000, 50, replace=False).tolist():
+            expected = HyperLogLog(0.05, minhash_counter_len=8)
+            expected.add_many(values[keys == key])
+            self.assertEqual(group[key], expected)
+            self.assertEqual(group[key].k, expected.k)
+            self.assertEqual(cards[key], expected.card())
+
+    def test_tuple_keys(self):
+        keys = [('s%d' % (key % 7), 'd%d' % (key % 3)) for key in self.keys.tolist()]
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        group.add_many(keys, self.values.astype(str))
+        group.add(('s0', 'd9'), 'x')
+        self.assertEqual(len(group), 22)
+        for key in [('s0', 'd0'), ('s6', 'd2')]:
+            expected = HyperLogLog(0.05, minhash_counter_len=64)
+            expected.add_many([str(value) for k, value in zip(keys, self.values.tolist()) if k == key])
+            self.assertEqual(group[key], expected)
+            self.assertEqual(group.card(key), expected.card())
+        self.assertEqual(len(group[('s0', 'd9')]), 1)
+
+    def test_mixed_keys(self):
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        group.add_many([1, '1', 2, 1], ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(group, key=repr), ['1', 1, 2])
+        self.assertEqual([len(group[key]) for key in [1, '1', 2]], [2, 1, 1])
+
+    def test_matches_dict(self):
+        rng = np.random.RandomState(2)
+        keys = rng.randint(0, 5000, 50000)
+        values = rng.randint(0, 10**9, len(keys)).astype(str)
+        group = HyperLogLogGroup(0.05, minhash_counter_len=64)
+        group.add_many(keys, values, batch_size=4096)
+        sketches = {}
+        for key, value in zip(keys.tolist(), values.tolist()):
+            if key not in sketches:
+                sketches[key] = HyperLogLog(0.05, minhash_counter_len=64)
+            sketches[key].add(value)
+        self.assertEqual(group.cards(), dict((key, hll.card()) for key, hll in sketches.items()))
+        for key in rng.choice(list(sketches), 100, replace=False).tolist():
+            self.assertEqual(group[key], sketches[key])
+            self.assertEqual(group[key].k, sketches[key].k)
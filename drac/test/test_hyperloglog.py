@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog, get_rho, get_rho_array, pack_registers, unpack_registers, get_nearest_neighbors, get_bias_tables
+from drac.const import rawEstimateData
+import drac
+import numpy as np
+import os
+import subprocess
+import mmh3
+import sys
+import base64
+import pickle
+import zlib
+
+# serialize() output of the original SortedSet based HyperLogLog(0.3, minhash_counter_len=16) after
+# adding str(i) for i in range(10): list registers and a SortedSet padded with placeholders >= 2 ** 64
+LEGACY_SERIALIZATION = (
+    'eJxrYJnqy8gABrVTNHpYE3MKMhKnuNs/7TT3Prb8Qw9jwRRvlh7G3CneAj2MvlNip2h4M3szeTMAIaM3K5SGYBAEyqT2MGZP6ZEq'
+    'zi8qSU1Jzs8rSczMSy0q1oMIFKeWTOnhDAazg4HsyVP6p2h0cTQsdru6795JrS4O187+ndOqcg27OBmggLGLkxHBZEIwmRFMFgST'
+    'Fc7k4Gvq/LR/UplnF+cMxcSNSydc/8vQxSkVuJjJd82eO0Cmy/Y5wn+3RDQzdHEsjYje5drqzdvF6bgyeNoz4ZPfgIKFNdVd/3b/'
+    'LuzirOjS7VxjUP+SYYJf25SgKT2s2fE5qXmgQOFKLSrKL4ovSixJBQbbZWMwKNUDADcQbUA=')
+
+
+class AddManyTestCase(TestCase):
+    def assertSameSketch(self, a, b):
+        self.assertEqual(a, b)
+        self.assertEqual(list(a.k), list(b.k))
+
+    def test_rho_array(self):
+        w = [0, 1, 2, 3, 7, 1 << 31, (1 << 32) - 1]
+        self.assertEqual(get_rho_array(np.array(w, dtype=np.uint64), 32).tolist(), [get_rho(i, 32) for i in w])
+        self.assertRaises(ValueError, get_rho_array, np.array([1 << 32], dtype=np.uint64), 32)
+
+    def test_add_many_matches_add(self):
+        values = [str(i) for i in range(5000)] + [os.urandom(8) for i in range(500)]
+        a = HyperLogLog(0.05, minhash_counter_len=256)
+        b = HyperLogLog(0.05, minhash_counter_len=256)
+        for v in values:
+            a.add(v)
+        b.add_many(values, batch_size=700)
+        self.assertSameSketch(a, b)
+
+    def test_add_many_generator_and_duplicates(self):
+        a = HyperLogLog(0.05, minhash_counter_len=64)
+        b = HyperLogLog(0.05, minhash_counter_len=64)
+        for i in range(300):
+            a.add(str(i % 100))
+        b.add_many((str(i % 100) for i in range(300)), batch_size=64)
+        self.assertSameSketch(a, b)
+
+    def test_add_many_numpy(self):
+        a = HyperLogLog(0.05, minhash_counter_len=128)
+        b = HyperLogLog(0.05, minhash_counter_len=128)
+        c = HyperLogLog(0.05, minhash_counter_len=128)
+        for i in range(2000):
+            a.add(str(i))
+        b.add_many(np.arange(2000))
+        c.add_many(np.array([str(i) for i in range(2000)]))
+        self.assertSameSketch(a, b)
+        self.assertSameSketch(a, c)
+
+
+class RegisterStorageTestCase(TestCase):
+    def test_registers_are_bytes(self):
+        s = HyperLogLog(0.01, sparse=False)
+        self.assertIsInstance(s.M, bytearray)
+        self.assertEqual(len(s.M), s.m)
+
+    def test_pack_registers(self):
+        M = bytearray(np.random.RandomState(0).randint(0, 62, 1024).astype(np.uint8).tobytes())
+        packed = pack_registers(M)
+        self.assertEqual(len(packed), 768)
+        self.assertEqual(unpack_registers(packed), M)
+
+    def test_serialize_roundtrip(self):
+        a = HyperLogLog(0.05)
+        a.add_many(str(i) for i in range(1000))
+        b = HyperLogLog(0.05)
+        b.setstate_from_serialization(a.serialize())
+        self.assertEqual(a, b)
+        self.assertEqual(a.card(), b.card())
+
+    def test_deserialize_list_registers(self):
+        a = HyperLogLog(0.05, sparse=False)
+        a.add_many(str(i) for i in range(1000))
+        state = dict([x, getattr(a, x)] for x in a.__slots__)
+        state['M'] = list(a.M)
+        b = HyperLogLog(0.05)
+        b.__setstate__(state)
+        self.assertEqual(a, b)
+
+    def test_deserialize_sortedset_without_sortedcontainers(self):
+        expected = HyperLogLog(0.3, minhash_counter_len=16)
+        expected.add_many(str(i) for i in range(10))
+        blocked = dict((name, None) for name in ('sortedcontainers', 'sortedcontainers.sortedset'))
+        saved = dict((name, sys.modules.get(name)) for name in blocked)
+        sys.modules.update(blocked)
+        try:
+            b = HyperLogLog(0.3, minhash_counter_len=16)
+            b.setstate_from_serialization(LEGACY_SERIALIZATION)
+        finally:
+            for name, module in saved.items():
+                if module is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = module
+        self.assertEqual(b, expected)
+        self.assertEqual(b.k, expected.k)
+
+    def test_update(self):
+        a = HyperLogLog(0.05)
+        b = HyperLogLog(0.05)
+        c = HyperLogLog(0.05)
+        a.add_many(str(i) for i in range(100))
+        b.add_many(str(i) for i in range(50, 200))
+        c.add_many(str(i) for i in range(200))
+        a.update(b)
+        self.assertEqual(a, c)
+        self.assertEqual(list(a.k), list(c.k))
+
+
+class SparseTestCase(TestCase):
+    def test_starts_sparse(self):
+        s = HyperLogLog(0.01)
+        self.assertTrue(s.is_sparse())
+        self.assertIsNone(s.M)
+
+    def test_converts_to_dense(self):
+        a = HyperLogLog(0.05)
+        b = HyperLogLog(0.05, sparse=False)
+        for i in range(2000):
+            a.add(str(i))
+            b.add(str(i))
+        self.assertFalse(a.is_sparse())
+        self.assertEqual(a.M, b.M)
+        self.assertEqual(a.card(), b.card())
+
+    def test_add_many_converts_to_dense(self):
+        a = HyperLogLog(0.05)
+        b = HyperLogLog(0.05, sparse=False)
+        a.add_many(str(i) for i in range(2000))
+        b.add_many(str(i) for i in range(2000))
+        self.assertEqual(a.M, b.M)
+
+    def test_sparse_equals_dense(self):
+        a = HyperLogLog(0.01)
+        b = HyperLogLog(0.01, sparse=False)
+        for i in range(100):
+            a.add(str(i))
+            b.add(str(i))
+        self.assertTrue(a.is_sparse())
+        self.assertEqual(a, b)
+
+    def test_sparse_card(self):
+        for n in [1, 10, 100, 1000]:
+            a = HyperLogLog(0.01)
+            a.add_many(str(i) for i in range(n))
+            self.assertTrue(a.is_sparse())
+            self.assertLess(abs(a.card() - n), 0.01 * n + 1)
+
+    def test_update_mixed(self):
+        a = HyperLogLog(0.05)
+        b = HyperLogLog(0.05, sparse=False)
+        c = HyperLogLog(0.05, sparse=False)
+        a.add_many(str(i) for i in range(20))
+        b.add_many(str(i) for i in range(10, 200))
+        c.add_many(str(i) for i in range(200))
+        a.update(b)
+        self.assertFalse(a.is_sparse())
+        self.assertEqual(a, c)
+
+        d = HyperLogLog(0.05)
+        e = HyperLogLog(0.05)
+        d.add_many(str(i) for i in range(20))
+        e.add_many(str(i) for i in range(10, 30))
+        d.update(e)
+        self.assertTrue(d.is_sparse())
+        self.assertEqual(len(d), 30)
+
+    def test_serialize_sparse(self):
+        a = HyperLogLog(0.01)
+        a.add_many(str(i) for i in range(100))
+        b = HyperLogLog(0.01)
+        b.setstate_from_serialization(a.serialize())
+        self.assertTrue(b.is_sparse())
+        self.assertEqual(a, b)
+        self.assertEqual(a.card(), b.card())
+
+    def test_intersection_mixed(self):
+        a = HyperLogLog(0.05)
+        b = HyperLogLog(0.05, sparse=False)
+        a.add_many(str(i) for i in range(100))
+        b.add_many(str(i) for i in range(50, 150))
+        self.assertAlmostEqual(HyperLogLog.get_corrected_jaccard([a, b]), 1 / 3., places=1)
+        self.assertTrue(40 <= HyperLogLog.get_intersection_card([a, b]) <= 60)
+
+
+class UnionManyTestCase(TestCase):
+    def setUp(self):
+        self.sketches = []
+        for n in [10, 50, 3000, 20, 1000]:
+            s = HyperLogLog(0.05, minhash_counter_len=128)
+            s.add_many(str(i) for i in range(n, 2 * n))
+            self.sketches.append(s)
+
+    def test_union_many_matches_update(self):
+        expected = HyperLogLog(0.05, minhash_counter_len=128)
+        expected.update(*self.sketches)
+        for tree in [False, True]:
+            union = HyperLogLog.union_many(self.sketches, tree=tree)
+            self.assertEqual(union, expected)
+            self.assertEqual(union.k, expected.k)
+            self.assertEqual(union.card(), expected.card())
+
+    def test_union_many_sparse(self):
+        union = HyperLogLog.union_many(self.sketches[:2])
+        self.assertTrue(union.is_sparse())
+        self.assertEqual(len(union), len(HyperLogLog.union_many(self.sketches[:2], tree=True)))
+
+    def test_union_many_leaves_inputs(self):
+        before = [s.serialize() for s in self.sketches]
+        HyperLogLog.union_many(self.sketches)
+        self.assertEqual([s.serialize() for s in self.sketches], before)
+
+    def test_union_many_errors(self):
+        self.assertRaises(ValueError, HyperLogLog.union_many, [])
+        self.assertRaises(ValueError, HyperLogLog.union_many, [HyperLogLog(0.05), HyperLogLog(0.01)])
+
+
+class CachedCardTestCase(TestCase):
+    def assertHistogram(self, s):
+        self.assertEqual(s.hist, np.bincount(np.frombuffer(s.M, dtype=np.uint8), minlength=64).tolist())
+
+    def test_histogram(self):
+        a = HyperLogLog(0.05, sparse=False)
+        for i in range(500):
+            a.add(str(i))
+        self.assertHistogram(a)
+        a.add_many(str(i) for i in range(500, 3000))
+        self.assertHistogram(a)
+        b = HyperLogLog(0.05)
+        b.add_many(str(i) for i in range(5000, 9000))
+        a.update(b)
+        self.assertHistogram(a)
+        self.assertHistogram(HyperLogLog.union_many([a, b]))
+
+    def test_card_cache(self):
+        for sparse in [True, False]:
+            a = HyperLogLog(0.05, sparse=sparse)
+            a.add_many(str(i) for i in range(100))
+            card = a.card()
+            self.assertEqual(a._card, card)
+            a.add('0')
+            self.assertEqual(a.card(), card)
+            a.add('new')
+            self.assertNotEqual(a.card(), card)
+            card = a.card()
+            b = HyperLogLog(0.05)
+            b.add_many(str(i) for i in range(100, 200))
+            a.update(b)
+            self.assertGreater(a.card(), card)
+
+
+class BiasCorrectionTestCase(TestCase):
+    def test_nearest_neighbors(self):
+        rng = np.random.RandomState(0)
+        for p in range(4, 19):
+            estimate_vector = rawEstimateData[p - 4]
+            for E in rng.uniform(estimate_vector[0] - 10, estimate_vector[-1] * 1.2, 500):
+                distance_map = sorted(((E - float(val)) ** 2, idx) for idx, val in enumerate(estimate_vector))
+                self.assertEqual(get_nearest_neighbors(E, estimate_vector), [idx for dist, idx in distance_map[:6]])
+                self.assertEqual(get_nearest_neighbors(E, get_bias_tables(p)[0]), [idx for dist, idx in distance_map[:6]])
+
+    def test_tables_load_lazily(self):
+        code = 'import sys, drac; print("drac.const" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(drac.__file__)))
+        self.assertEqual(output.strip(), b'False')
+
+
+class BinaryFormatTestCase(TestCase):
+    def setUp(self):
+        self.dense = HyperLogLog(0.05, minhash_counter_len=256)
+        self.dense.add_many(str(i) for i in range(5000))
+        self.sparse = HyperLogLog(0.01, minhash_counter_len=256)
+        self.sparse.add_many(str(i) for i in range(100))
+
+    def test_roundtrip(self):
+        for hll in [self.dense, self.sparse]:
+            for packed in [False, True]:
+                for compress in [False, True]:
+                    data = hll.to_bytes(packed=packed, compress=compress)
+                    self.assertEqual(data[:4], b'DRAC')
+                    for copy in [HyperLogLog.from_bytes(data), HyperLogLog.from_buffer(data)]:
+                        self.assertEqual(copy, hll)
+                        self.assertEqual(copy.k, hll.k)
+                        self.assertEqual(copy.is_sparse(), hll.is_sparse())
+                        self.assertEqual(copy.card(), hll.card())
+                        self.assertEqual((copy.p, copy.k_len, copy.error_rate), (hll.p, hll.k_len, hll.error_rate))
+
+    def test_sizes(self):
+        self.assertEqual(len(self.dense.to_bytes()), 32 + self.dense.m + 8 * 256)
+        self.assertEqual(len(self.dense.to_bytes(packed=True)), 32 + 3 * self.dense.m // 4 + 8 * 256)
+        self.assertLess(len(self.sparse.to_bytes()), 32 + 4 * 100 + 8 * 100 + 1)
+
+    def test_zero_copy(self):
+        data = bytearray(self.dense.to_bytes())
+        copy = HyperLogLog.from_buffer(data)
+        self.assertIsInstance(copy.M, memoryview)
+        data[32] = 60
+        self.assertEqual(copy.M[0], 60)
+
+        copy = HyperLogLog.from_buffer(self.dense.to_bytes())
+        copy.add_many(str(i) for i in range(5000, 6000))
+        expected = HyperLogLog(0.05, minhash_counter_len=256)
+        expected.add_many(str(i) for i in range(6000))
+        self.assertIsInstance(copy.M, bytearray)
+        self.assertEqual(copy, expected)
+        self.assertEqual(copy.k, expected.k)
+
+    def test_legacy_serialization(self):
+        copy = HyperLogLog.from_bytes(self.dense.serialize(), allow_pickle=True)
+        self.assertEqual(copy, self.dense)
+        self.assertEqual(copy.k, self.dense.k)
+
+        # written by the original code: list registers and a padded SortedSet
+        expected = HyperLogLog(0.3, minhash_counter_len=16)
+        expected.add_many(str(i) for i in range(10))
+        copy = HyperLogLog.from_bytes(LEGACY_SERIALIZATION, allow_pickle=True)
+        self.assertEqual(copy, expected)
+        self.assertEqual(copy.k, expected.k)
+        self.assertEqual(copy.card(), expected.card())
+        self.assertEqual((copy.p, copy.k_len, copy.error_rate), (4, 16, 0.3))
+
+    def test_pickle_needs_opt_in(self):
+        self.assertRaises(ValueError, HyperLogLog.from_bytes, LEGACY_SERIALIZATION)
+        self.assertRaises(ValueError, HyperLogLog.from_buffer, self.dense.serialize().encode('ascii'))
+        self.assertRaises(ValueError, HyperLogLog.from_bytes, b'XXXX' + self.dense.to_bytes()[4:])
+        # even when allowed, pickles may only reference the classes of serialize strings
+        evil = base64.b64encode(zlib.compress(pickle.dumps(os.getcwd)))
+        self.assertRaises(pickle.UnpicklingError, HyperLogLog.from_bytes, evil, allow_pickle=True)
+
+    def test_truncated(self):
+        for hll in [self.dense, self.sparse]:
+            for packed in [False, True]:
+                data = hll.to_bytes(packed=packed)
+                for cut in [10, 32, 40, len(data) - 8, len(data) - 1]:
+                    with self.assertRaisesRegex(ValueError, 'Truncated|payload is'):
+                        HyperLogLog.from_buffer(data[:cut])
+                self.assertRaises(ValueError, HyperLogLog.from_bytes, data + b'\0')
+        self.assertRaises(ValueError, HyperLogLog.from_bytes, self.dense.to_bytes(compress=True)[:-3])
+
+    def test_bad_minhash_len(self):
+        data = bytearray(self.dense.to_bytes())
+        # k_len is the uint32 at offset 16 of the header, right before the minhash count n
+        data[16:20] = (len(self.dense.k) - 1).to_bytes(4, 'little')
+        self.assertRaisesRegex(ValueError, 'minhash', HyperLogLog.from_bytes, data)
+        empty = bytearray(HyperLogLog(0.05).to_bytes())
+        empty[16:20] = bytes(4)
+        hll = HyperLogLog.from_bytes(empty)
+        hll.add('a')
+        self.assertEqual((hll.k_len, len(hll.k), len(hll)), (0, 0, 1))
+
+    def test_bad_version(self):
+        data = bytearray(self.dense.to_bytes())
+        data[4] = 99
+        self.assertRaises(ValueError, HyperLogLog.from_bytes, data)
+
+
+class PairwiseTestCase(TestCase):
+    def setUp(self):
+        self.sketches = []
+        for start, stop in [(0, 1000), (0, 500), (250, 750), (900, 3000), (5000, 5010)]:
+            s = HyperLogLog(0.05, minhash_counter_len=256)
+            s.add_many(str(i) for i in range(start, stop))
+            self.sketches.append(s)
+
+    def assertMatchesPairs(self, jaccard, intersection, sketches):
+        for i, a in enumerate(sketches):
+            for j, b in enumerate(sketches):
+                self.assertEqual(jaccard[i, j], HyperLogLog.get_corrected_jaccard([a, b]))
+                self.assertEqual(intersection[i, j], HyperLogLog.get_intersection_card([a, b]))
+
+    def test_pairwise(self):
+        jaccard = HyperLogLog.pairwise_jaccard(self.sketches)
+        intersection = HyperLogLog.pairwise_intersection(self.sketches)
+        self.assertEqual(jaccard.shape, (5, 5))
+        self.assertMatchesPairs(jaccard, intersection, self.sketches)
+
+    def test_pairwise_different_k_len(self):
+        other = HyperLogLog(0.05, minhash_counter_len=64)
+        other.add_many(str(i) for i in range(300, 600))
+        sketches = self.sketches + [other]
+        self.assertMatchesPairs(HyperLogLog.pairwise_jaccard(sketches), HyperLogLog.pairwise_intersection(sketches), sketches)
+
+    def test_pairwise_processes(self):
+        jaccard = HyperLogLog.pairwise_jaccard(self.sketches, processes=2)
+        intersection = HyperLogLog.pairwise_intersection(self.sketches, processes=2)
+        self.assertMatchesPairs(jaccard, intersection, self.sketches)
+
+    def test_pairwise_empty(self):
+        jaccard = HyperLogLog.pairwise_jaccard([HyperLogLog(0.05), self.sketches[0]])
+        self.assertTrue(np.isnan(jaccard[0, 0]))
+        self.assertEqual(jaccard[0, 1], HyperLogLog.get_corrected_jaccard([HyperLogLog(0.05), self.sketches[0]]))
+        self.assertEqual(jaccard[1, 1], 1.0)
+
+
+class PreHashedTestCase(TestCase):
+    def test_hash_values(self):
+        values = [str(i) for i in range(1000)]
+        hashes = drac.hash_values(iter(values), batch_size=300)
+        self.assertEqual(hashes.dtype, np.uint64)
+        self.assertEqual(hashes.tolist(), [mmh3.hash64(v, signed=False)[0] for v in values])
+        self.assertEqual(len(drac.hash_values([])), 0)
+
+    def test_add_hashes(self):
+        values = [str(i) for i in range(3000)]
+        hashes = drac.hash_values(values)
+        expected = HyperLogLog(0.05, minhash_counter_len=128)
+        expected.add_many(values)
+        a = HyperLogLog(0.05, minhash_counter_len=128)
+        b = HyperLogLog(0.05, minhash_counter_len=128)
+        a.add_hashes(hashes)
+        for x in hashes.tolist():
+            b.add_hash(x)
+        for hll in [a, b]:
+            self.assertEqual(hll, expected)
+            self.assertEqual(hll.k, expected.k)
+
+    def test_add_hash_numpy_scalar(self):
+        values = [str(i) for i in range(3000)]
+        hashes = drac.hash_values(values)
+        for sparse in [True, False]:
+            expected = HyperLogLog(0.05, minhash_counter_len=128, sparse=sparse)
+            expected.add_many(values)
+            hll = HyperLogLog(0.05, minhash_counter_len=128, sparse=sparse)
+            for i in range(len(hashes)):
+                hll.add_hash(hashes[i])
+            self.assertEqual(hll, expected)
+            self.assertEqual(hll.k, expected.k)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.minhash import BottomK, merge_sorted
+import numpy as np
+import pickle
+
+
+class BottomKTestCase(TestCase):
+    def test_empty(self):
+        k = BottomK(16)
+        self.assertEqual(len(k), 0)
+        self.assertEqual(k.threshold, 2**64)
+
+    def test_zero_k(self):
+        k = BottomK(0, [1, 2, 3])
+        k.add(0)
+        self.assertEqual(len(k), 0)
+        self.assertEqual(k.threshold, 0)
+
+    def test_add_keeps_smallest(self):
+        rng = np.random.RandomState(0)
+        values = rng.randint(0, 2**63, 1000, dtype=np.uint64).tolist()
+        k = BottomK(50)
+        for v in values + values:
+            k.add(v)
+        self.assertEqual(list(k), sorted(set(values))[:50])
+        self.assertEqual(k.threshold, sorted(set(values))[49])
+
+    def test_update_matches_add(self):
+        rng = np.random.RandomState(1)
+        values = rng.randint(0, 2**63, 5000, dtype=np.uint64)
+        a = BottomK(100)
+        b = BottomK(100)
+        for v in values.tolist():
+            a.add(v)
+        b.update(values[:2000], values[1000:])
+        self.assertEqual(a, b)
+        self.assertEqual(a[-1], a.threshold)
+
+    def test_large_hashes(self):
+        k = BottomK(2)
+        k.add(2**64 - 1)
+        k.add(2**63)
+        k.add(2**64 - 2)
+        self.assertEqual(list(k), [2**63, 2**64 - 2])
+
+    def test_pickle(self):
+        k = BottomK(10, [5, 3, 9])
+        k.add(1)
+        copy = pickle.loads(pickle.dumps(k))
+        self.assertEqual(k, copy)
+        self.assertEqual(list(copy), [1, 3, 5, 9])
+
+    def test_union(self):
+        a = BottomK(4, [1, 5, 9, 11])
+        b = BottomK(3, [2, 5, 7])
+        union = BottomK.union([a, b], 4)
+        self.assertEqual(list(union), [1, 2, 5, 7])
+        self.assertEqual(union.threshold, 7)
+        self.assertEqual(list(merge_sorted([a.sorted(), b.sorted()], 10)), [1, 2, 5, 7, 9, 11])
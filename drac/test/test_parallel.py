@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog
+from drac.parallel import build_parallel, iter_file_shards, iter_shard_lines
+import gzip
+import os
+import shutil
+import tempfile
+
+
+class BuildParallelTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.values = [str(i) for i in range(20000)]
+        self.expected = HyperLogLog(0.05, minhash_counter_len=256)
+        self.expected.add_many(self.values)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameSketch(self, hll):
+        self.assertEqual(hll, self.expected)
+        self.assertEqual(hll.k, self.expected.k)
+
+    def test_iterable(self):
+        hll = build_parallel(iter(self.values), workers=2, error_rate=0.05, minhash_counter_len=256, chunk_size=3000)
+        self.assertSameSketch(hll)
+
+    def test_many_chunks(self):
+        # far more chunks than tasks allowed in flight
+        hll = build_parallel(iter(self.values), workers=2, error_rate=0.05, minhash_counter_len=256, chunk_size=200)
+        self.assertSameSketch(hll)
+
+    def test_source_error(self):
+        def values():
+            yield from self.values[:5000]
+            raise KeyError('broken source')
+        self.assertRaises(KeyError, build_parallel, values(), workers=2, error_rate=0.05, minhash_counter_len=256, chunk_size=100)
+
+    def test_files(self):
+        path = os.path.join(self.dir, 'values.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.values[:15000]) + '\n')
+        gz_path = os.path.join(self.dir, 'values.txt.gz')
+        with gzip.open(gz_path, 'wt') as f:
+            f.write('\r\n'.join(self.values[12000:]))
+        hll = build_parallel([path, gz_path], workers=3, error_rate=0.05, minhash_counter_len=256, files=True, shard_size=10000)
+        self.assertSameSketch(hll)
+
+    def test_shard_lines(self):
+        path = os.path.join(self.dir, 'values.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.values) + '\n')
+        shards = list(iter_file_shards([path], 777))
+        self.assertGreater(len(shards), 100)
+        lines = [line for shard in shards for line in iter_shard_lines(*shard)]
+        self.assertEqual(lines, [i.encode() for i in self.values])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog
+from drac.query import QueryEngine, parse
+
+
+class QueryEngineTestCase(TestCase):
+    def setUp(self):
+        ranges = {'A': (0, 1000), 'B': (0, 500), 'C': (250, 750), 'D': (2000, 2400)}
+        self.sets = dict((name, set(range(*r))) for name, r in ranges.items())
+        self.sketches = {}
+        for name, values in self.sets.items():
+            self.sketches[name] = HyperLogLog(0.01, minhash_counter_len=4096)
+            self.sketches[name].add_many(str(i) for i in values)
+        self.engine = QueryEngine(self.sketches)
+
+    def test_parse(self):
+        self.assertEqual(parse('A'), ('name', 'A'))
+        self.assertEqual(parse('A | B & C'), ('|', ('name', 'A'), ('&', ('name', 'B'), ('name', 'C'))))
+        self.assertEqual(parse('(A | B) & C - D'), ('&', ('|', ('name', 'A'), ('name', 'B')), ('-', ('name', 'C'), ('name', 'D'))))
+        self.assertEqual(parse('"Clark St & Elm St" ∩ B'), ('&', ('name', 'Clark St & Elm St'), ('name', 'B')))
+        for bad in ['A &', '(A | B', 'A B', '& A', 'A $ B']:
+            self.assertRaises(ValueError, parse, bad)
+
+    def test_matches_statics(self):
+        a, b, c = self.sketches['A'], self.sketches['B'], self.sketches['C']
+        self.assertEqual(self.engine.evaluate('A').estimate, a.card())
+        self.assertEqual(self.engine.evaluate('A | B | C').estimate, HyperLogLog.union_many([a, b, c]).card())
+        self.assertEqual(int(self.engine.evaluate('B & C').estimate), HyperLogLog.get_intersection_card([b, c]))
+        self.assertEqual(int(self.engine.evaluate('A & B & C').estimate), HyperLogLog.get_intersection_card([a, b, c]))
+
+    def test_expressions(self):
+        A, B, C, D = [self.sets[name] for name in 'ABCD']
+        for expression, expected in [('A - B', A - B), ('B - C', B - C), ('(A & B) | C', (A & B) | C),
+                                     ('(B | C) & A', (B | C) & A), ('A - (B | C)', A - (B | C)),
+                                     ('(A | D) - (B & C)', (A | D) - (B & C)), ('C & D', C & D)]:
+            result = self.engine.evaluate(expression)
+            self.assertLess(abs(result.estimate - len(expected)), max(4 * result.error, 0.03 * len(A)), expression)
+            self.assertGreaterEqual(result.error, 0)
+
+    def test_cache(self):
+        first = self.engine.evaluate('(A & B) | C')
+        intersections = dict(self.engine.intersections)
+        unions = dict(self.engine.unions)
+        self.assertEqual(self.engine.evaluate('( A&B )|C'), first)
+        self.engine.evaluate('A & B')
+        self.assertEqual(self.engine.intersections, intersections)
+        self.assertEqual(self.engine.unions, unions)
+
+        hll = HyperLogLog(0.01)
+        self.engine['A'] = hll
+        self.assertEqual(self.engine.intersections, {})
+        self.assertEqual(self.engine.evaluate('A').estimate, 0)
+
+    def test_missing_name(self):
+        self.assertRaises(KeyError, self.engine.evaluate, 'A & Z')
+
+    def test_empty_sketches(self):
+        engine = QueryEngine({'A': HyperLogLog(0.01), 'B': HyperLogLog(0.01), 'C': self.sketches['C']})
+        for expression in ['A', 'A & B', 'A - B', 'A | B', '(A | B) - C', 'A & C']:
+            self.assertEqual(engine.evaluate(expression), (0.0, 0.0), expression)
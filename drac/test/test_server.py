@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import drac
+from drac.hll import HyperLogLog
+from drac.server import SketchServer, SketchClient, RequestError
+from drac.store import SketchStore
+
+
+class SketchServerTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sketches.drac')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def serve(self, test, **kwargs):
+        async def run():
+            server = SketchServer(snapshot_path=self.path, error_rate=0.05, minhash_counter_len=256, **kwargs)
+            await server.start()
+            client = await SketchClient.connect(port=server.port)
+            try:
+                return await test(server, client)
+            finally:
+                await client.close()
+                await server.stop()
+        return asyncio.run(run())
+
+    def expected(self, values):
+        hll = HyperLogLog(0.05, minhash_counter_len=256)
+        hll.add_many(values)
+        return hll
+
+    def test_add_and_query(self):
+        a = [str(i) for i in range(3000)]
+        b = [str(i) for i in range(1500, 5000)]
+
+        async def test(server, client):
+            # concurrent batches of adds, then reads that must see all of them
+            await asyncio.gather(*[client.add('a', a[i:i + 500]) for i in range(0, len(a), 500)])
+            await client.add('b', b)
+            self.assertEqual(await client.card('a'), self.expected(a).card())
+            self.assertEqual(await client.jaccard(['a', 'b']), HyperLogLog.get_corrected_jaccard([self.expected(a), self.expected(b)]))
+            self.assertEqual(await client.intersection(['a', 'b']), HyperLogLog.get_intersection_card([self.expected(a), self.expected(b)]))
+            self.assertEqual(await client.names(), ['a', 'b'])
+            with self.assertRaises(RequestError):
+                await client.card('missing')
+            stats = await client.stats()
+            self.assertEqual(stats['add']['count'], 7)
+            self.assertTrue(0 <= stats['card']['p50'] <= stats['card']['p99'])
+        self.serve(test, flush_interval=10)
+
+    def test_coalescing(self):
+        async def test(server, client):
+            await client.add('a', [str(i) for i in range(2000)])
+            calls = []
+            query = server._query
+            def counting_query(*args):
+                calls.append(args[:2])
+                return query(*args)
+            server._query = counting_query
+            results = await asyncio.gather(*[client.jaccard(['a', 'a']) for _ in range(20)])
+            self.assertEqual(len(set(results)), 1)
+            self.assertLess(len(calls), 20)
+            # a query after an add must not reuse the earlier result
+            await client.add('a', [str(i) for i in range(2000, 4000)])
+            self.assertEqual(await client.card('a'), self.expected([str(i) for i in range(4000)]).card())
+        self.serve(test)
+
+    def test_snapshot(self):
+        values = [str(i) for i in range(1000)]
+
+        async def test(server, client):
+            await client.add('a', values)
+            self.assertTrue(await client.snapshot())
+        self.serve(test)
+        with SketchStore(self.path, readonly=True) as store:
+            self.assertEqual(store['a'], self.expected(values))
+
+        # a restarted server loads the snapshot
+        async def test(server, client):
+            await client.add('a', [str(i) for i in range(1000, 2000)])
+            return await client.card('a')
+        self.assertEqual(self.serve(test), self.expected([str(i) for i in range(2000)]).card())
+
+    def test_bad_values(self):
+        async def test(server, client):
+            with self.assertRaises(RequestError):
+                await client.add('x', [1, 2, 3])
+            with self.assertRaises(RequestError):
+                await client.request('add', name='x', values='abc')
+            self.assertEqual(await client.names(), [])
+            await client.add('x', ['a', 'b'])
+            self.assertEqual(await client.card('x'), self.expected(['a', 'b']).card())
+        self.serve(test)
+
+    def test_failed_flush(self):
+        values = [str(i) for i in range(100)]
+
+        async def test(server, client):
+            apply = server._apply
+            failures = []
+            def failing_apply(batches):
+                if not failures:
+                    failures.append(True)
+                    raise MemoryError('first flush fails')
+                apply(batches)
+            server._apply = failing_apply
+            await client.add('a', values)
+            # the values survive the failed periodic flush and the next one applies them
+            while 'a' not in server.sketches:
+                await asyncio.sleep(0.01)
+            self.assertEqual(failures, [True])
+            self.assertFalse(server.tasks[0].done())
+            self.assertEqual(server.sketches['a'], self.expected(values))
+        self.serve(test, flush_interval=0.01)
+
+    def test_keeps_empty_sketch(self):
+        async def test(server, client):
+            # an empty sketch with other parameters, as loaded from a snapshot
+            server.sketches['a'] = HyperLogLog(0.1, minhash_counter_len=64)
+            await client.add('a', ['x', 'y'])
+            await client.card('a')
+            self.assertEqual((server.sketches['a'].error_rate, server.sketches['a'].k_len), (0.1, 64))
+        self.serve(test)
+
+    def test_lazy_import(self):
+        code = 'import sys, drac; print("drac.server" in sys.modules, "asyncio" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(drac.__file__)))
+        self.assertEqual(output.split(), [b'False', b'False'])
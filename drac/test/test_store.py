@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog
+from drac.store import SketchStore, record_header
+import os
+import shutil
+import tempfile
+
+
+class SketchStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sketches.drac')
+        self.sketches = {}
+        for n in [10, 100, 5000]:
+            hll = HyperLogLog(0.05, minhash_counter_len=128)
+            hll.add_many(str(i) for i in range(n))
+            self.sketches['station %d' % n] = hll
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertStored(self, store):
+        self.assertEqual(sorted(store), sorted(self.sketches))
+        for key, hll in self.sketches.items():
+            self.assertEqual(store[key], hll)
+            self.assertEqual(store[key].k, hll.k)
+            self.assertEqual(store[key].card(), hll.card())
+
+    def test_set_and_reopen(self):
+        with SketchStore(self.path) as store:
+            for key, hll in self.sketches.items():
+                store[key] = hll
+            self.assertStored(store)
+        with SketchStore(self.path, readonly=True) as store:
+            self.assertStored(store)
+            self.assertRaises(IOError, store.__setitem__, 'x', HyperLogLog())
+
+    def test_append_many_replace_delete(self):
+        with SketchStore(self.path) as store:
+            store.append_many(self.sketches)
+            store['extra'] = HyperLogLog()
+            replacement = HyperLogLog(0.05, minhash_counter_len=128)
+            replacement.add('x')
+            store['station 10'] = replacement
+            self.sketches['station 10'] = replacement
+            del store['extra']
+            self.assertRaises(KeyError, store.__delitem__, 'extra')
+            self.assertNotIn('extra', store)
+            self.assertStored(store)
+        with SketchStore(self.path) as store:
+            self.assertStored(store)
+
+    def test_mapped_registers(self):
+        with SketchStore(self.path) as store:
+            store.append_many(self.sketches)
+            hll = store['station 5000']
+            self.assertIsInstance(hll.M, memoryview)
+            hll.add('new value')
+            self.assertEqual(store['station 5000'], self.sketches['station 5000'])
+
+    def test_compact(self):
+        with SketchStore(self.path) as store:
+            store.append_many(self.sketches)
+            store.append_many(self.sketches)
+            store['extra'] = HyperLogLog()
+            del store['extra']
+            loaded = store['station 100']
+            size = os.path.getsize(self.path)
+            self.assertGreater(store.garbage(), 0)
+            store.compact()
+            self.assertEqual(store.garbage(), 0)
+            self.assertLess(os.path.getsize(self.path), size)
+            self.assertStored(store)
+            self.assertEqual(loaded, self.sketches['station 100'])
+
+    def test_not_a_store(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'something else entirely')
+        self.assertRaises(ValueError, SketchStore, self.path)
+
+    def test_torn_last_record(self):
+        with SketchStore(self.path) as store:
+            store.append_many(self.sketches)
+            complete = os.path.getsize(self.path)
+            store['torn'] = HyperLogLog(0.05, minhash_counter_len=128)
+            size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # cut inside the record header, the key and the data of the last record
+        for cut in [complete + 5, complete + 18, size - 1]:
+            with open(self.path, 'wb') as f:
+                f.write(data[:cut])
+            with SketchStore(self.path, readonly=True) as store:
+                self.assertStored(store)
+            self.assertEqual(os.path.getsize(self.path), cut)
+            with SketchStore(self.path) as store:
+                self.assertStored(store)
+                self.assertEqual(store.garbage(), 0)
+                store['after'] = self.sketches['station 10']
+            self.assertEqual(os.path.getsize(self.path), complete + record_header.size + len('after') + len(self.sketches['station 10'].to_bytes()))
+            with SketchStore(self.path, readonly=True) as store:
+                self.assertEqual(store['after'], self.sketches['station 10'])
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertRaises(ValueError, SketchStore, self.path, readonly=True)
+        with SketchStore(self.path) as store:
+            self.assertEqual(len(store), 0)
+            store.append_many(self.sketches)
+        with SketchStore(self.path, readonly=True) as store:
+            self.assertStored(store)
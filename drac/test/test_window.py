@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from drac.hll import HyperLogLog
+from drac.window import WindowedHyperLogLog
+import numpy as np
+
+
+class WindowedHyperLogLogTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.timestamps = np.sort(rng.uniform(0, 600, 20000))
+        self.values = rng.randint(0, 3000, len(self.timestamps))
+
+    def expected(self, first, last):
+        # union of the buckets first..last built directly from the values
+        hll = HyperLogLog(0.05, minhash_counter_len=128)
+        buckets = (self.timestamps // 10).astype(int)
+        hll.add_many(self.values[(buckets >= first) & (buckets <= last)])
+        return hll
+
+    def assertSameSketch(self, a, b):
+        self.assertEqual(a, b)
+        self.assertEqual(a.k, b.k)
+
+    def test_ranges(self):
+        window = WindowedHyperLogLog(10, 60, 0.05, minhash_counter_len=128)
+        window.add_many(self.values, self.timestamps)
+        self.assertSameSketch(window.union(), self.expected(0, 59))
+        for start, end in [(0, 9), (15, 333), (250, 599), (-100, 1000), (590, 599)]:
+            self.assertSameSketch(window.union(start, end), self.expected(start // 10, end // 10))
+            self.assertEqual(window.card(start, end), self.expected(start // 10, end // 10).card())
+
+    def test_add_matches_add_many(self):
+        a = WindowedHyperLogLog(10, 20, 0.05, minhash_counter_len=128)
+        b = WindowedHyperLogLog(10, 20, 0.05, minhash_counter_len=128)
+        for value, timestamp in zip(self.values[:3000].tolist(), self.timestamps[:3000].tolist()):
+            a.add(str(value), timestamp)
+        b.add_many(self.values[:3000], self.timestamps[:3000])
+        for start, end in [(None, None), (20, 70)]:
+            self.assertSameSketch(a.union(start, end), b.union(start, end))
+
+    def test_add_many_nul_bytes(self):
+        values = [b'a\x00', b'a', b'b\x00', b'x' * 10000]
+        a = WindowedHyperLogLog(10, 20, 0.05, minhash_counter_len=128)
+        b = WindowedHyperLogLog(10, 20, 0.05, minhash_counter_len=128)
+        for value, timestamp in zip(values, [5, 15, 5, 25]):
+            a.add(value, timestamp)
+        b.add_many(values, [5, 15, 5, 25])
+        self.assertSameSketch(a.union(), b.union())
+        self.assertEqual(len(b.union()), 4)
+
+    def test_expiry(self):
+        window = WindowedHyperLogLog(10, 7, 0.05, minhash_counter_len=128)
+        for start in range(0, 600, 50):
+            # feed the values a chunk at a time so buckets expire and the ring wraps around
+            chunk = (self.timestamps >= start) & (self.timestamps < start + 50)
+            window.add_many(self.values[chunk], self.timestamps[chunk])
+            self.assertSameSketch(window.union(), self.expected(start // 10 - 2, start // 10 + 4))
+            self.assertSameSketch(window.union(start - 20, start + 25), self.expected(start // 10 - 2, start // 10 + 2))
+        self.assertFalse(window.add('late', 0))
+        window.advance(10000)
+        self.assertEqual(window.card(), 0)
+
+    def test_intersection_card(self):
+        window = WindowedHyperLogLog(10, 60, 0.05, minhash_counter_len=128)
+        window.add_many(self.values, self.timestamps)
+        ranges = [(0, 299), (200, 599)]
+        expected = HyperLogLog.get_intersection_card([self.expected(0, 29), self.expected(20, 59)])
+        self.assertEqual(window.intersection_card(ranges), expected)
+        self.assertEqual(WindowedHyperLogLog(10, 60).intersection_card([(0, 10), (20, 30)]), 0)
+        self.assertEqual(window.intersection_card([(-500, -100), (-90, -50)]), 0)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, WindowedHyperLogLog, 0, 10)
+        self.assertRaises(ValueError, WindowedHyperLogLog(1, 10).add_many, [1, 2], [1])
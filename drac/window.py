@@ -0,0 +1,176 @@
+"""
+This module implements a sliding time window of HyperLogLog counters with cached range unions
+"""
+
+import numpy as np
+from .hll import HyperLogLog
+
+
+class WindowedHyperLogLog(object):
+    """
+    HyperLogLog counters for the last n_intervals fixed time intervals
+    """
+
+    def __init__(self, interval, n_intervals, error_rate=0.01, minhash_counter_len=2**16):
+        """
+        Creates an empty window of n_intervals buckets of interval time units each
+
+        Buckets live in a ring buffer and expire as newer timestamps arrive. A segment tree
+        over the ring caches the union of every node's buckets, so the union of any range of
+        buckets merges O(log n_intervals) cached sketches; only the nodes above a changed
+        bucket are recomputed, lazily, on the next query that needs them.
+        """
+        if interval <= 0 or n_intervals < 1:
+            raise ValueError('interval and n_intervals should be positive')
+        self.interval = interval
+        self.n = n_intervals
+        self.error_rate = error_rate
+        self.k_len = minhash_counter_len
+        self.size = 1
+        while self.size < n_intervals:
+            self.size *= 2
+        self.bucket_ids = [None] * n_intervals # slot -> absolute bucket number it holds
+        self.nodes = [None] * (2 * self.size) # segment tree, leaves at size + slot; None when empty
+        self.dirty = [False] * (2 * self.size) # internal nodes whose cached union is stale
+        self.latest = None # newest absolute bucket number
+
+    def bucket(self, timestamp):
+        """
+        Returns the absolute bucket number of timestamp
+        """
+        return int(timestamp // self.interval)
+
+    def _invalidate(self, slot):
+        i = (self.size + slot) // 2
+        while i and not self.dirty[i]:
+            self.dirty[i] = True
+            i //= 2
+
+    def advance(self, timestamp):
+        """
+        Moves the window forward to timestamp, expiring the buckets that fall out of it
+        """
+        b = self.bucket(timestamp)
+        if self.latest is not None and b <= self.latest:
+            return
+        first = b - self.n + 1 if self.latest is None else max(self.latest + 1, b - self.n + 1)
+        for expired in range(first, b + 1):
+            slot = expired % self.n
+            if self.bucket_ids[slot] is not None:
+                self.bucket_ids[slot] = None
+                self.nodes[self.size + slot] = None
+                self._invalidate(slot)
+        self.latest = b
+
+    def _bucket_hll(self, b):
+        """
+        Returns the counter of absolute bucket b, creating it, or None if b is outside the window
+        """
+        if b <= self.latest - self.n:
+            return None
+        slot = b % self.n
+        if self.bucket_ids[slot] != b:
+            self.bucket_ids[slot] = b
+            self.nodes[self.size + slot] = HyperLogLog(self.error_rate, self.k_len)
+        self._invalidate(slot)
+        return self.nodes[self.size + slot]
+
+    def add(self, value, timestamp):
+        """
+        Adds value at timestamp; values older than the window are dropped and False is returned
+        """
+        self.advance(timestamp)
+        hll = self._bucket_hll(self.bucket(timestamp))
+        if hll is None:
+            return False
+        hll.add(value)
+        return True
+
+    def add_many(self, values, timestamps):
+        """
+        Adds values[i] at timestamps[i] for every i, with one add_many per bucket
+        """
+        timestamps = np.asarray(timestamps)
+        if len(values) != len(timestamps):
+            raise ValueError('values and timestamps should have the same length')
+        if not len(timestamps):
+            return
+        self.advance(timestamps.max())
+        buckets = np.floor_divide(timestamps, self.interval).astype(np.int64)
+        order = np.argsort(buckets, kind='stable')
+        # fixed width str/bytes arrays would drop trailing NUL bytes of the values
+        values = values[order] if isinstance(values, np.ndarray) else np.asarray(values, dtype=object)[order]
+        buckets = buckets[order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        for start, stop in zip(starts, np.r_[starts[1:], len(buckets)]):
+            hll = self._bucket_hll(int(buckets[start]))
+            if hll is not None:
+                hll.add_many(values[start:stop])
+
+    def _node(self, i):
+        """
+        Returns the cached union of node i, recomputing it when stale
+        """
+        if i < self.size and self.dirty[i]:
+            children = [hll for hll in (self._node(2 * i), self._node(2 * i + 1)) if hll is not None]
+            if len(children) == 2:
+                self.nodes[i] = HyperLogLog.union_many(children)
+            else:
+                self.nodes[i] = children[0] if children else None
+            self.dirty[i] = False
+        return self.nodes[i]
+
+    def _range_nodes(self, lo, hi):
+        """
+        Returns the non-empty nodes covering the slots lo..hi-1
+        """
+        nodes = []
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                nodes.append(self._node(lo))
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                nodes.append(self._node(hi))
+            lo //= 2
+            hi //= 2
+        return [hll for hll in nodes if hll is not None]
+
+    def union(self, start=None, end=None):
+        """
+        Returns a new HyperLogLog of all values added between the timestamps start and end
+
+        Both ends are inclusive at bucket granularity and default to the whole window.
+        """
+        hll = HyperLogLog(self.error_rate, self.k_len)
+        if self.latest is None:
+            return hll
+        first = self.latest - self.n + 1 if start is None else max(self.bucket(start), self.latest - self.n + 1)
+        last = self.latest if end is None else min(self.bucket(end), self.latest)
+        if first > last:
+            return hll
+        # the buckets first..last are contiguous in the ring, except where they wrap around
+        lo, hi = first % self.n, last % self.n
+        if lo <= hi:
+            nodes = self._range_nodes(lo, hi + 1)
+        else:
+            nodes = self._range_nodes(lo, self.n) + self._range_nodes(0, hi + 1)
+        return HyperLogLog.union_many(nodes) if nodes else hll
+
+    def card(self, start=None, end=None):
+        """
+        Returns the estimated number of distinct values added between start and end, see union
+        """
+        return self.union(start, end).card()
+
+    def intersection_card(self, ranges):
+        """
+        Returns the estimated number of distinct values added in every one of the (start, end) ranges
+        """
+        hlls = [self.union(start, end) for start, end in ranges]
+        if not any(hll.card() for hll in hlls):
+            # get_intersection_card would divide by the zero card of the union
+            return 0
+        return HyperLogLog.get_intersection_card(hlls)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 version = '0.1.4'
 
@@ -12,22 +12,24 @@ setup(
     author='Scott Little',
     author_email='scott.alan.little@gmail.com',
     packages=['drac','drac.test'],
+    entry_points={
+        'console_scripts': ['drac=drac.cli:main'],
+    },
     description='HyperLogLog cardinality counter',
     url='https://github.com/scottlittle/drac',
     install_requires=[
         'mmh3>=3.0.0',
-        'sortedcontainers>=2.4.0',
+        'numpy>=1.17',
     ],
     setup_requires=[
         'mmh3>=3.0.0',
-        'sortedcontainers>=2.4.0',
+        'numpy>=1.17',
     ],
+    python_requires='>=3.8',
     license='LGPL 2.1 or later',
     classifiers=[
     'Development Status :: 3 - Alpha',     
     'Programming Language :: Python :: 3',      
-    'Programming Language :: Python :: 3.6',
-    'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3.8',
     'Programming Language :: Python :: 3.9',
   ],